@@ -1,843 +1,2190 @@
-try:
-    import ntptime
-    NTPTIME_AVAILABLE = True
-except ImportError:
-    print("警告: ntptime 模块不可用。时间同步功能将被禁用。")
-    NTPTIME_AVAILABLE = False
-
-import network
-import socket
-import time
-import json
-import machine
-
-AP_SSID = "ESP32_Setup"
-AP_PASSWORD = "12345678"
-AP_AUTHMODE = network.AUTH_WPA_WPA2_PSK
-WEB_PORT = 80
-WIFI_CONNECT_TIMEOUT = 30
-
-DAYS_IN_MONTH = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
-
-g_ap_interface = None
-
-def is_leap_year(year):
-    return (year % 4 == 0 and year % 100 != 0) or (year % 400 == 0)
-
-def set_time():
-    if not NTPTIME_AVAILABLE:
-        print("时间同步失败：ntptime 模块不可用。")
-        return
-    
-    print("正在同步NTP时间...")
-
-    servers_to_try = ["pool.ntp.org", "ntp.aliyun.com", "cn.pool.ntp.org"]
-
-    for host in servers_to_try:
-        try:
-            print(f"尝试 NTP 服务器: {host}")
-            
-            if hasattr(ntptime, 'host'):
-                original_host = getattr(ntptime, 'host', None)
-                ntptime.host = host
-
-            ntp_timestamp = ntptime.time()
-            print(f"NTP时间同步成功 (使用服务器 {host})。获取到的 Unix 时间戳 (1970-based): {ntp_timestamp}")
-
-            utc_tm_tuple = time.gmtime(ntp_timestamp)
-            print(f"使用 gmtime 解析的 UTC 时间元组 (1970-based): {utc_tm_tuple}")
-
-            year_1970_based = utc_tm_tuple[0]
-            adjusted_year_for_rtc = year_1970_based - 2000
-            
-            if adjusted_year_for_rtc < 0 or adjusted_year_for_rtc > 255:
-                 raise ValueError(f"调整后的年份 {year_1970_based} ({adjusted_year_for_rtc} for RTC) 超出 ESP32 RTC 支持范围 (0-255)。")
-
-            rtc_datetime_tuple = (
-                adjusted_year_for_rtc,
-                utc_tm_tuple[1],
-                utc_tm_tuple[2],
-                utc_tm_tuple[6],
-                utc_tm_tuple[3],
-                utc_tm_tuple[4],
-                utc_tm_tuple[5],
-                0
-            )
-            print(f"准备设置的 RTC 8元组 (年份已调整为相对于 2000): {rtc_datetime_tuple}")
-
-            rtc = machine.RTC()
-            rtc_before = rtc.datetime()
-            print(f"设置 RTC 前读取到的时间: {rtc_before}")
-
-            rtc.datetime(rtc_datetime_tuple)
-            print("RTC 已手动设置为准确的 UTC 时间 (年份已按 ESP32 内部纪元调整)。")
-
-            rtc_after = rtc.datetime()
-            print(f"设置 RTC 后读取到的时间: {rtc_after}")
-
-            final_timestamp = time.time()
-            print(f"设置后再次读取 time.time() (应为 1970-based): {final_timestamp}")
-            print(f"time.time() 差值 (应接近0): {final_timestamp - ntp_timestamp}")
-
-            if hasattr(ntptime, 'host') and original_host is not None:
-                ntptime.host = original_host
-
-            return
-
-        except (AttributeError, ValueError) as specific_error:
-             print(f"使用 NTP 服务器 {host} 时出现特定错误: {specific_error}")
-             if hasattr(ntptime, 'host') and original_host is not None:
-                 try:
-                     ntptime.host = original_host
-                 except:
-                     pass
-             continue
-
-        except Exception as e1:
-            print(f"使用 NTP 服务器 {host} 同步或设置时间时出错: {e1}")
-            if hasattr(ntptime, 'host') and original_host is not None:
-                try:
-                    ntptime.host = original_host
-                except:
-                    pass
-            continue
-
-    print("警告：所有 NTP 时间同步尝试均失败。设备时间可能不准确。")
-    print("常见原因：未连接到互联网，或防火墙阻止了UDP端口123。")
-
-
-def get_beijing_time_tuple():
-    rtc = machine.RTC()
-    rtc_tuple = rtc.datetime()
-    year_adjusted_back = rtc_tuple[0] + 2000
-    return (year_adjusted_back, rtc_tuple[1], rtc_tuple[2], rtc_tuple[4], rtc_tuple[5], rtc_tuple[6])
-
-def get_beijing_timestamp():
-    try:
-        rtc = machine.RTC()
-        rtc_tuple = rtc.datetime()
-        year = rtc_tuple[0] + 2000
-        month = rtc_tuple[1]
-        day = rtc_tuple[2]
-        hour = rtc_tuple[4]
-        minute = rtc_tuple[5]
-        second = rtc_tuple[6]
-
-        days = 0
-        for y in range(1970, year):
-            if is_leap_year(y):
-                days += 366
-            else:
-                days += 365
-
-        for m in range(1, month):
-            days += DAYS_IN_MONTH[m - 1]
-            if m == 2 and is_leap_year(year):
-                days += 1
-
-        days += day - 1
-
-        timestamp = days * 24 * 3600 + hour * 3600 + minute * 60 + second + (8 * 3600)
-        return timestamp
-    except Exception as e:
-        print(f"计算时间戳时出错: {e}")
-        return 0
-
-def format_time(tm_tuple):
-    year, month, day, hour, minute, second = tm_tuple[:6]
-    return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(year, month, day, hour, minute, second)
-
-
-def start_ap(ssid, password):
-    global g_ap_interface
-    print(f"正在启动/重启 SoftAP '{ssid}'...")
-    sta_if = network.WLAN(network.STA_IF)
-    if sta_if.active():
-        print("启动 AP 前停用 STA 接口...")
-        sta_if.disconnect()
-        sta_if.active(False)
-        time.sleep(1)
-
-    if g_ap_interface is None:
-        print("初始化 AP 接口...")
-        g_ap_interface = network.WLAN(network.AP_IF)
-    ap = g_ap_interface
-
-    try:
-        if ap.active():
-            print("停用现有 AP...")
-            ap.active(False)
-            time.sleep(0.5)
-
-        print("配置 AP 参数...")
-        ap.config(essid=ssid, authmode=AP_AUTHMODE, password=password)
-        print("激活 AP 接口...")
-        ap.active(True)
-
-    except Exception as e:
-        print(f"配置/激活 AP 时出错: {e}。")
-        try:
-            print("尝试回退到开放网络配置...")
-            ap.config(essid=ssid)
-            ap.active(True)
-        except Exception as e2:
-            print(f"回退启动 AP 也失败了: {e2}")
-        return None, None
-
-    print("等待 AP 激活...")
-    timeout = 10
-    while not ap.active() and timeout > 0:
-        time.sleep(0.5)
-        timeout -= 1
-        print(".", end='')
-        
-    if ap.active():
-        ip_address = ap.ifconfig()[0]
-        print(f"\nSoftAP '{ssid}' 已激活。IP 地址: {ip_address}")
-        return ap, ip_address
-    else:
-        print("\n多次尝试后仍未成功启动/重启 SoftAP。")
-        return None, None
-
-
-def scan_wifi_networks():
-    print("正在扫描 WiFi 网络...")
-    sta_if = network.WLAN(network.STA_IF)
-    was_active = sta_if.active()
-    if not was_active:
-        sta_if.active(True)
-        time.sleep(1)
-        
-    try:
-        nets = sta_if.scan()
-        ssids = []
-        for net in nets:
-            ssid_bytes = net[0]
-            try:
-                ssid_str = ssid_bytes.decode('utf-8')
-                if ssid_str:
-                    ssids.append(ssid_str)
-            except UnicodeDecodeError:
-                print(f"跳过具有非 UTF-8 SSID 的网络: {ssid_bytes}")
-                pass
-                
-        unique_ssids = sorted(list(set(ssids)))
-        print(f"扫描完成。找到 {len(unique_ssids)} 个唯一网络。")
-        return unique_ssids
-    except Exception as e:
-        print(f"WiFi 扫描期间出错: {e}")
-        return []
-    finally:
-        if not was_active:
-            sta_if.active(False)
-
-
-def simple_unquote(s):
-    if '%' not in s and '+' not in s:
-        return s
-    res = ''
-    i = 0
-    while i < len(s):
-        if s[i] == '%':
-            try:
-                hex_val = s[i+1:i+3]
-                char_val = int(hex_val, 16)
-                res += chr(char_val)
-                i += 3
-            except (ValueError, IndexError):
-                res += s[i]
-                i += 1
-        elif s[i] == '+':
-            res += ' '
-            i += 1
-        else:
-            res += s[i]
-            i += 1
-    return res
-
-def parse_form_data(encoded_data):
-    data = {}
-    pairs = encoded_data.replace('+', ' ').split('&')
-    for pair in pairs:
-        if '=' in pair:
-            key, value = pair.split('=', 1)
-            key_decoded = simple_unquote(key)
-            value_decoded = simple_unquote(value)
-            data[key_decoded] = value_decoded
-    return data
-
-
-def generate_initial_html(error_msg="", pre_selected_ssid=""):
-    pre_selected_ssid_str = str(pre_selected_ssid) if pre_selected_ssid is not None else ""
-    
-    error_div = f'<div id="error-message" style="color:red; background-color: #ffebee; padding: 10px; border-radius: 4px; margin-bottom: 15px;">{error_msg}</div>' if error_msg else ""
-    
-    html_content = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>ESP32 WiFi 配置</title>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            padding: 15px;
-            margin: 0;
-            background-color: #f4f4f4;
-        }}
-        h1 {{
-            color: #333;
-        }}
-        #scan-connect-section {{
-            background-color: #fff;
-            padding: 15px;
-            border-radius: 4px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }}
-        label {{
-            display: block;
-            margin-bottom: 5px;
-            font-weight: bold;
-        }}
-        input[type="password"], select {{
-            width: 100%;
-            padding: 10px;
-            margin-bottom: 15px;
-            border: 1px solid #ccc;
-            border-radius: 4px;
-            box-sizing: border-box;
-        }}
-        button {{
-            background-color: #2196F3;
-            color: white;
-            padding: 12px 20px;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            width: 100%;
-            font-size: 16px;
-        }}
-        button:hover {{
-            background-color: #1976D2;
-        }}
-        ul {{
-            list-style-type: none;
-            padding: 0;
-        }}
-        li {{
-            padding: 8px 0;
-            border-bottom: 1px solid #eee;
-        }}
-        #status {{
-            margin-top: 10px;
-            font-style: italic;
-            color: #666;
-        }}
-
-        @media screen and (min-width: 600px) {{
-            body {{
-                padding: 20px;
-            }}
-            #scan-connect-section {{
-                max-width: 600px;
-                margin: 0 auto 15px auto;
-            }}
-        }}
-    </style>
-</head>
-<body>
-    <h1>ESP32 WiFi 配置</h1>
-
-    {error_div}
-
-    <div id="scan-connect-section">
-        <h3>正在扫描网络...</h3>
-        <form id="wifi-form">
-            <label for="ssid-select">选择网络:</label>
-            <select name="ssid" id="ssid-select">
-                <option value="">-- 请选择 --</option>
-            </select><br><br>
-
-            <div id="password-field" style="display:none;">
-                <label for="password-input">密码:</label>
-                <input type="password" name="password" id="password-input"><br><br>
-            </div>
-
-            <button type="submit">连接</button>
-        </form>
-        <div id="status">正在连接网络...</div>
-        <ul id="network-list"></ul>
-    </div>
-
-    <script>
-        let networks = [];
-
-        function updateNetworkList() {{
-            const listElement = document.getElementById('network-list');
-            const selectElement = document.getElementById('ssid-select');
-
-            listElement.innerHTML = '';
-            selectElement.innerHTML = '<option value="">-- 请选择 --</option>';
-
-            networks.forEach(net => {{
-                const li = document.createElement('li');
-                li.textContent = net;
-                listElement.appendChild(li);
-
-                const option = document.createElement('option');
-                option.value = net;
-                option.textContent = net;
-
-                if (net === "{pre_selected_ssid_str}") {{
-                    option.selected = true;
-                }}
-                selectElement.appendChild(option);
-            }});
-        }}
-
-        function scanNetworks() {{
-            fetch('/scan')
-                .then(response => response.json())
-                .then(data => {{
-                    networks = data.networks || [];
-                    updateNetworkList();
-                    document.querySelector('h3').textContent = '可用网络:';
-                }})
-                .catch(error => {{
-                    console.error('扫描失败:', error);
-                    document.querySelector('h3').textContent = '扫描失败，请刷新页面重试。';
-                }});
-        }}
-
-        document.addEventListener('DOMContentLoaded', () => {{
-            scanNetworks();
-
-            document.getElementById('ssid-select').addEventListener('change', (event) => {{
-                const selectedSSID = event.target.value;
-                const passwordField = document.getElementById('password-field');
-                if (selectedSSID) {{
-                    passwordField.style.display = 'block';
-                }} else {{
-                    passwordField.style.display = 'none';
-                }}
-            }});
-
-            document.getElementById('wifi-form').addEventListener('submit', (event) => {{
-                event.preventDefault();
-
-                const formData = new FormData(event.target);
-                const ssid = formData.get('ssid');
-                const password = formData.get('password');
-
-                if (!ssid) {{
-                    alert('请选择一个网络。');
-                    return;
-                }}
-
-                document.getElementById('status').textContent = `正在连接到 ${{ssid}}...`;
-
-                fetch('/configure', {{
-                    method: 'POST',
-                    body: new URLSearchParams(formData),
-                    headers: {{
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                    }},
-                }})
-                .then(response => {{
-                    if (response.ok || response.status === 500) {{
-                        return response.text();
-                    }} else {{
-                        throw new Error(`HTTP error! Status: ${{response.status}}`);
-                    }}
-                }})
-                .then(html => {{
-                    document.open();
-                    document.write(html);
-                    document.close();
-                }})
-                .catch(error => {{
-                    console.error('连接请求失败:', error);
-                    document.getElementById('status').textContent = '连接请求发送失败。';
-                }});
-            }});
-        }});
-    </script>
-</body>
-</html>"""
-    return html_content
-
-def generate_success_html(device_ip):
-
-    rtc = machine.RTC()
-    rtc_time = rtc.datetime()
-    year = rtc_time[0] + 2000
-    month = rtc_time[1]
-    day = rtc_time[2]
-    hour = rtc_time[4]
-    minute = rtc_time[5]
-    second = rtc_time[6]
-    
-    beijing_hour = (hour + 8) % 24
-    beijing_day = day
-    if hour + 8 >= 24:
-        beijing_day += 1
-        
-    html_content = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>ESP32 WiFi 配置 - 成功</title>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            padding: 15px;
-            margin: 0;
-            background-color: #f4f4f4;
-        }}
-        #success-section {{
-            background-color: #e8f5e9;
-            padding: 15px;
-            border-radius: 4px;
-            margin-bottom: 15px;
-            text-align: center;
-        }}
-        #time-display {{
-            font-family: monospace;
-        }}
-        a {{
-            display: inline-block;
-            margin-top: 10px;
-            color: #2196F3;
-            text-decoration: none;
-        }}
-        a:hover {{
-            text-decoration: underline;
-        }}
-
-        @media screen and (min-width: 600px) {{
-            body {{
-                padding: 20px;
-            }}
-            #success-section {{
-                max-width: 600px;
-                margin: 0 auto 15px auto;
-            }}
-        }}
-    </style>
-</head>
-<body>
-    <div id="success-section">
-        <h2>成功!</h2>
-        <p>已成功连接到 WiFi 网络。</p>
-        <p>您的 ESP32 新 IP 地址是: <strong>{device_ip}</strong></p>
-        <p>当前北京时间是: <strong id='time-display'>{year:04d}-{month:02d}-{day:02d} {beijing_hour:02d}:{minute:02d}:{second:02d}</strong></p>
-        <a href="/">返回网络选择</a>
-    </div>
-
-    <script>
-        // 使用服务器时间作为基准
-        function padZero(num) {{
-            return num.toString().padStart(2, '0');
-        }}
-
-        // 获取服务器时间作为基准
-        const serverYear = {year};
-        const serverMonth = {month};
-        const serverDay = {day};
-        const serverHour = {beijing_hour};
-        const serverMinute = {minute};
-        const serverSecond = {second};
-
-        // 计算服务器时间戳（北京时间）
-        const serverDate = new Date(serverYear, serverMonth - 1, serverDay, serverHour, serverMinute, serverSecond);
-        const serverTimestamp = serverDate.getTime();
-
-        function updateTimeDisplay() {{
-            try {{
-                // 获取当前时间并计算偏移
-                const now = new Date();
-                const elapsedMs = now.getTime() - serverTimestamp;
-                
-                // 计算当前时间
-                const currentDate = new Date(serverDate.getTime() + elapsedMs);
-
-                const year = currentDate.getFullYear();
-                const month = padZero(currentDate.getMonth() + 1);
-                const day = padZero(currentDate.getDate());
-                const hours = padZero(currentDate.getHours());
-                const minutes = padZero(currentDate.getMinutes());
-                const seconds = padZero(currentDate.getSeconds());
-
-                const formattedTime = `${{year}}-${{month}}-${{day}} ${{hours}}:${{minutes}}:${{seconds}}`;
-                document.getElementById('time-display').textContent = formattedTime;
-            }} catch (err) {{
-                console.error("更新时间显示时出错:", err);
-                document.getElementById('time-display').textContent = "时间获取失败";
-            }}
-        }}
-
-        // 立即更新一次
-        updateTimeDisplay();
-        
-        // 每秒更新一次时间显示
-        setInterval(updateTimeDisplay, 1000);
-    </script>
-</body>
-</html>"""
-    return html_content
-
-def generate_error_html(message, pre_selected_ssid=""):
-    pre_selected_ssid_str = str(pre_selected_ssid) if pre_selected_ssid is not None else ""
-    return generate_initial_html(error_msg=message, pre_selected_ssid=pre_selected_ssid)
-
-def recv_all(client_socket, length):
-    data = b''
-    while len(data) < length:
-        try:
-            packet = client_socket.recv(length - len(data))
-            if not packet:
-                return None
-            data += packet
-        except OSError as e:
-            return None
-    return data
-
-def attempt_wifi_connection(ssid, password):
-    print(f"正在尝试连接到 WiFi: '{ssid}'...")
-    print("激活 STA 接口...")
-    sta_if = network.WLAN(network.STA_IF)
-    if not sta_if.active():
-        sta_if.active(True)
-        time.sleep(1)
-
-    if sta_if.isconnected():
-        print("断开之前的网络连接...")
-        sta_if.disconnect()
-        time.sleep(1)
-
-    print("开始连接...")
-    sta_if.connect(ssid, password)
-
-    print(f"等待最多 {WIFI_CONNECT_TIMEOUT} 秒钟连接...")
-    wait_time = 0
-    while not sta_if.isconnected() and wait_time < WIFI_CONNECT_TIMEOUT:
-        time.sleep(1)
-        wait_time += 1
-        print(".", end="")
-
-    if sta_if.isconnected():
-        print("\n已成功连接到 WiFi！")
-        set_time()
-        ifconfig_tuple = sta_if.ifconfig()
-        device_ip_on_home_network = ifconfig_tuple[0]
-        print("网络配置:", ifconfig_tuple)
-        return True, device_ip_on_home_network
-    else:
-        print(f"\n在 {WIFI_CONNECT_TIMEOUT} 秒内未能连接到 WiFi '{ssid}'。")
-        return False, ""
-
-def handle_client(client_socket, ap_ip):
-    try:
-        request_line_bytes = b""
-        while b"\r\n" not in request_line_bytes:
-            try:
-                chunk = client_socket.recv(1)
-                if not chunk:
-                    return
-                request_line_bytes += chunk
-            except OSError as e:
-                return
-
-        request_line = request_line_bytes.decode('utf-8').strip()
-        print(f"请求行: {request_line}")
-
-        parts = request_line.split()
-        if len(parts) < 2:
-            print("无效的请求行")
-            return
-
-        method, path_and_query = parts[0], parts[1]
-        path_parts = path_and_query.split('?', 1)
-        path = path_parts[0]
-        query_string = path_parts[1] if len(path_parts) > 1 else ""
-
-        headers = {}
-        while True:
-            header_line_bytes = b""
-            while b"\r\n" not in header_line_bytes:
-                try:
-                    chunk = client_socket.recv(1)
-                    if not chunk:
-                        return
-                    header_line_bytes += chunk
-                except OSError as e:
-                    return
-
-            header_line = header_line_bytes.decode('utf-8').strip()
-            if header_line == "":
-                break
-            if ':' in header_line:
-                key, value = header_line.split(':', 1)
-                headers[key.strip().lower()] = value.strip()
-
-        if method == "GET" and path == "/":
-            get_params = parse_form_data(query_string)
-            ssid_from_get = get_params.get("ssid", "").strip()
-            password_from_get = get_params.get("password", "")
-
-            if ssid_from_get:
-                print(f"在 GET 参数中发现 SSID: '{ssid_from_get}'。正在尝试连接...")
-                is_connected, ip_or_error = attempt_wifi_connection(ssid_from_get, password_from_get)
-                if is_connected:
-                    html_page = generate_success_html(ip_or_error)
-                    response_headers = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
-                    client_socket.send(response_headers.encode('utf-8'))
-                    client_socket.send(html_page.encode('utf-8'))
-                    client_socket.close()
-                    return
-                else:
-                    error_message = f"连接到 '{ssid_from_get}' 失败。请检查密码和信号强度，然后重试。"
-                    html_page = generate_error_html(error_message, pre_selected_ssid=ssid_from_get)
-                    response_headers = "HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
-                    client_socket.send(response_headers.encode('utf-8'))
-                    client_socket.send(html_page.encode('utf-8'))
-                    client_socket.close()
-                    return
-            else:
-                html_page = generate_initial_html()
-                response_headers = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
-                client_socket.send(response_headers.encode('utf-8'))
-                client_socket.send(html_page.encode('utf-8'))
-                client_socket.close()
-
-        elif method == "GET" and path == "/scan":
-            ssid_list = scan_wifi_networks()
-            response_data = {"networks": ssid_list}
-            response_json = json.dumps(response_data)
-            response_headers = "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n"
-            client_socket.send(response_headers.encode('utf-8'))
-            client_socket.send(response_json.encode('utf-8'))
-            client_socket.close()
-
-        elif method == "POST" and path == "/configure":
-            content_length_str = headers.get("content-length")
-            if not content_length_str:
-                print("缺少 Content-Length 头部")
-                client_socket.send("HTTP/1.1 411 Length Required\r\n\r\n".encode())
-                client_socket.close()
-                return
-
-            try:
-                content_length = int(content_length_str)
-            except ValueError:
-                print("Content-Length 无效")
-                client_socket.send("HTTP/1.1 400 Bad Request\r\n\r\n".encode())
-                client_socket.close()
-                return
-
-            post_data_bytes = recv_all(client_socket, content_length)
-            if post_data_bytes is None:
-                print("接收 POST 数据时连接关闭")
-                return
-
-            post_data_str = post_data_bytes.decode('utf-8')
-            print(f"收到的 POST 数据: {post_data_str}")
-
-            form_data = parse_form_data(post_data_str)
-            ssid_input = form_data.get("ssid", "").strip()
-            password_input = form_data.get("password", "")
-
-            if not ssid_input:
-                error_message = "未选择网络。请从列表中选择一个网络。"
-                html_page = generate_error_html(error_message, pre_selected_ssid=ssid_input)
-                response_headers = "HTTP/1.1 400 Bad Request\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
-                client_socket.send(response_headers.encode('utf-8'))
-                client_socket.send(html_page.encode('utf-8'))
-                client_socket.close()
-            else:
-                is_connected, ip_or_error = attempt_wifi_connection(ssid_input, password_input)
-                if is_connected:
-                    html_page = generate_success_html(ip_or_error)
-                    response_headers = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
-                    client_socket.send(response_headers.encode('utf-8'))
-                    client_socket.send(html_page.encode('utf-8'))
-                    client_socket.close()
-                else:
-                    error_message = f"连接到 '{ssid_input}' 失败。请检查密码和信号强度，然后重试。"
-                    html_page = generate_error_html(error_message, pre_selected_ssid=ssid_input)
-                    response_headers = "HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
-                    client_socket.send(response_headers.encode('utf-8'))
-                    client_socket.send(html_page.encode('utf-8'))
-                    client_socket.close()
-
-        else:
-            response_headers = "HTTP/1.1 404 Not Found\r\n\r\n"
-            client_socket.send(response_headers.encode('utf-8'))
-            client_socket.close()
-
-    except Exception as e:
-        print(f"处理客户端时出错: {e}")
-        try:
-            client_socket.send("HTTP/1.1 500 Internal Server Error\r\n\r\n".encode())
-        except:
-            pass
-    finally:
-        try:
-            client_socket.close()
-        except:
-            pass
-
-def main():
-    print("--- ESP32-S3 WiFi 设置门户 ---")
-    print("正在进行初始 WiFi 接口清理...")
-    sta_if = network.WLAN(network.STA_IF)
-    ap_if = network.WLAN(network.AP_IF)
-
-    if sta_if.active():
-        sta_if.disconnect()
-        sta_if.active(False)
-    if ap_if.active():
-        ap_if.active(False)
-    time.sleep(1)
-    print("初始清理完成。")
-
-    ap, ap_ip = start_ap(AP_SSID, AP_PASSWORD)
-    if not ap:
-        print("致命错误：无法启动初始 SoftAP。程序退出。")
-        return
-
-    print(f"Web 服务器已在 http://{ap_ip}:{WEB_PORT} 启动")
-    print(f"请连接到 WiFi '{AP_SSID}' (密码 '{AP_PASSWORD}')，然后在浏览器中打开 http://{ap_ip}:{WEB_PORT} 。")
-
-    addr = socket.getaddrinfo(ap_ip, WEB_PORT)[0][-1]
-    server_socket = socket.socket()
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-        server_socket.bind(addr)
-    except OSError as e:
-        print(f"绑定服务器套接字失败: {e}")
-        return
-    server_socket.listen(1)
-    print(f"Web 服务器已在 http://{ap_ip}:{WEB_PORT} 启动")
-
-    try:
-        while True:
-            try:
-                client_socket, client_addr = server_socket.accept()
-                print(f"\n客户端已连接，来自 {client_addr}")
-            except OSError as e:
-                print(f"接受连接时出错: {e}")
-                continue
-            handle_client(client_socket, ap_ip)
-
-    except KeyboardInterrupt:
-        print("\n服务器被用户停止。")
-    except Exception as e:
-        print(f"\n主循环中发生未预期的错误: {e}")
-    finally:
-        server_socket.close()
-        print("Web 服务器套接字已关闭。")
-
-if __name__ == "__main__":
-    main()
+import time
+
+if not hasattr(time, "ticks_ms"):
+    import host_emulation
+g_boot_ticks = time.ticks_ms()
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+try:
+    import network
+    import machine
+except ImportError:
+    from host_emulation import network, machine
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+import gc
+import os
+import socket
+import struct
+import sys
+import json
+import hashlib
+import binascii
+
+AP_SSID = "ESP32_Setup"
+AP_PASSWORD = "12345678"
+AP_AUTHMODE = network.AUTH_WPA_WPA2_PSK
+WEB_PORT = 80
+BIND_ADDRESS = "0.0.0.0"
+WIFI_CONNECT_TIMEOUT = 30
+LISTEN_BACKLOG = 8
+REQUEST_BUFFER_SIZE = 2048
+MAX_REQUEST_LINE = 512
+MAX_CONTENT_LENGTH = 1024
+HEADER_TIMEOUT = 5
+BODY_TIMEOUT = 10
+SEND_TIMEOUT = 10
+SEND_BUFFER_SIZE = 1536
+MAX_CONNECTION_SLOTS = 6
+REQUEST_HEAP_BUDGET = 4096
+SEND_CHUNK_SIZE = 1460
+KEEPALIVE_IDLE_TIMEOUT = 5
+MAX_KEEPALIVE_REQUESTS = 20
+MAX_JOBS = 4
+SCAN_CACHE_TTL = 15
+SCAN_RSSI_CHANGE_DB = 5
+MAX_EVENT_STREAMS = 3
+MAX_PENDING_EVENTS = 16
+DNS_PORT = 53
+DNS_TTL = 60
+DNS_MAX_PACKET = 512
+CAPTIVE_PROBE_PATHS = (
+    "/generate_204", "/gen_204", "/hotspot-detect.html", "/library/test/success.html",
+    "/ncsi.txt", "/connecttest.txt", "/redirect", "/canonical.html", "/success.txt",
+)
+CREDENTIALS_FILE = "wifi_credentials.json"
+ASSET_DIR = "www"
+ASSET_SOURCE_DIR = "static"
+ASSET_MANIFEST = "manifest.json"
+ASSET_SOURCES = ("portal.css", "portal.js", "success.js")
+ASSET_URL_PREFIX = "/static/"
+FAST_RECONNECT_TIMEOUT_MS = 5000
+FAST_RECONNECT_STATIC_IP = True
+MAX_PROFILES = 8
+ROAM_CHECK_INTERVAL = 10
+ROAM_MAX_RETRY_INTERVAL = 300
+ROAM_AP_FALLBACK_ROUNDS = 1
+READY_POLL_INITIAL_MS = 10
+READY_POLL_MAX_MS = 250
+AP_ACTIVE_TIMEOUT_MS = 5000
+INTERFACE_RESET_TIMEOUT_MS = 1000
+
+JOB_QUEUED = "queued"
+JOB_ASSOCIATING = "associating"
+JOB_GOT_IP = "got_ip"
+JOB_NTP_SYNCING = "ntp_syncing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_RETRYING = "retrying"
+
+CONNECT_MAX_RETRIES = 2
+CONNECT_RETRY_BACKOFF_MS = 500
+STA_STATUS_GOT_IP = getattr(network, "STAT_GOT_IP", 1010)
+STA_FAILURE_REASONS = {
+    getattr(network, "STAT_WRONG_PASSWORD", 202): "wrong_password",
+    getattr(network, "STAT_NO_AP_FOUND", 201): "no_ap_found",
+    getattr(network, "STAT_HANDSHAKE_TIMEOUT", 204): "handshake_timeout",
+    getattr(network, "STAT_ASSOC_FAIL", 203): "assoc_fail",
+    getattr(network, "STAT_BEACON_TIMEOUT", 200): "beacon_timeout",
+}
+TRANSIENT_CONNECT_FAILURES = ("handshake_timeout", "assoc_fail", "beacon_timeout")
+CONNECT_FAILURE_MESSAGES = {
+    "wrong_password": "连接到 '{}' 失败：密码错误。",
+    "no_ap_found": "连接到 '{}' 失败：找不到该网络，请确认它在信号范围内。",
+    "handshake_timeout": "连接到 '{}' 失败：握手超时，可能是信号较弱或密码错误。",
+    "assoc_fail": "连接到 '{}' 失败：路由器拒绝了关联请求。",
+    "beacon_timeout": "连接到 '{}' 失败：与路由器的连接中断，请检查信号强度。",
+    "timeout": "连接到 '{}' 超时。请检查密码和信号强度，然后重试。",
+}
+
+UTC_OFFSET_SECONDS = 8 * 3600
+RTC_YEAR_BASE = 2000
+
+NTP_SERVERS = ["pool.ntp.org", "ntp.aliyun.com", "cn.pool.ntp.org"]
+NTP_PORT = 123
+NTP_TIMEOUT_MS = 3000
+NTP_DELTA = 2208988800
+TIME_SYNC_MIN_INTERVAL = 64
+TIME_SYNC_MAX_INTERVAL = 4 * 3600
+TIME_SYNC_SETTLED_US = 20000
+TIME_DRIFT_MIN_ELAPSED = 60
+TIME_DRIFT_INITIAL_ERROR_PPB = 50000
+
+IS_MICROPYTHON = sys.implementation.name == "micropython"
+HAS_MEM_INFO = hasattr(gc, "mem_alloc")
+
+HTTP_METHODS = ("GET", "POST", "HEAD", "PUT", "DELETE", "OPTIONS")
+HTTP_METHODS_BYTES = tuple(method.encode() for method in HTTP_METHODS)
+HEADER_WHITELIST = ("host", "content-length", "transfer-encoding", "connection", "accept-encoding", "if-none-match")
+HEADER_WHITELIST_BYTES = tuple(name.encode() for name in HEADER_WHITELIST)
+
+HTTP_STATUS_LINES = {
+    200: b"HTTP/1.1 200 OK\r\n",
+    202: b"HTTP/1.1 202 Accepted\r\n",
+    302: b"HTTP/1.1 302 Found\r\n",
+    304: b"HTTP/1.1 304 Not Modified\r\n",
+    400: b"HTTP/1.1 400 Bad Request\r\n",
+    404: b"HTTP/1.1 404 Not Found\r\n",
+    408: b"HTTP/1.1 408 Request Timeout\r\n",
+    409: b"HTTP/1.1 409 Conflict\r\n",
+    411: b"HTTP/1.1 411 Length Required\r\n",
+    413: b"HTTP/1.1 413 Payload Too Large\r\n",
+    414: b"HTTP/1.1 414 URI Too Long\r\n",
+    431: b"HTTP/1.1 431 Request Header Fields Too Large\r\n",
+    500: b"HTTP/1.1 500 Internal Server Error\r\n",
+    503: b"HTTP/1.1 503 Service Unavailable\r\n",
+}
+CONTENT_TYPE_HTML = b"Content-Type: text/html\r\n"
+CONTENT_TYPE_JSON = b"Content-Type: application/json\r\n"
+CONTENT_TYPE_EVENTS = b"Content-Type: text/event-stream\r\n"
+CONTENT_TYPE_METRICS = b"Content-Type: text/plain; version=0.0.4\r\n"
+ASSET_CONTENT_TYPES = {
+    "css": b"Content-Type: text/css\r\n",
+    "js": b"Content-Type: application/javascript\r\n",
+}
+CACHE_NO_CACHE = b"Cache-Control: no-cache\r\n"
+CACHE_NO_STORE = b"Cache-Control: no-store\r\n"
+CACHE_IMMUTABLE = b"Cache-Control: public, max-age=31536000, immutable\r\n"
+RETRY_AFTER_EVENTS = b"Retry-After: 5\r\n"
+CONTENT_ENCODING_GZIP = b"Content-Encoding: gzip\r\n"
+KEEP_ALIVE_HEADERS = b"Connection: keep-alive\r\nKeep-Alive: timeout=" + str(KEEPALIVE_IDLE_TIMEOUT).encode() + b"\r\n\r\n"
+CLOSE_HEADERS = b"Connection: close\r\n\r\n"
+
+METRICS_ENABLED = const(1)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+DURATION_BUCKETS_MS = (500, 1000, 2000, 3000, 5000, 10000, 20000, 30000)
+NTP_OFFSET_BUCKETS_US = (1000, 5000, 20000, 100000, 500000, 1000000)
+
+g_radio_lock = asyncio.Lock()
+g_jobs = {}
+g_next_job_id = 1
+g_sta_ip = ""
+g_scan_results = None
+g_scan_ticks = 0
+g_scan_event = None
+g_index_page = None
+g_assets = {}
+g_asset_paths = {}
+g_scan_version = 0
+g_scan_history = {}
+g_event_subscribers = []
+g_portal_host = ""
+g_before_request = []
+g_after_request = []
+
+def days_from_civil(year, month, day):
+    if month <= 2:
+        year -= 1
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month - 3 if month > 2 else month + 9) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def civil_from_days(days):
+    days += 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    year = yoe + era * 400 + (1 if month <= 2 else 0)
+    return year, month, day
+
+def weekday_from_days(days):
+    return (days + 3) % 7
+
+def timestamp_from_civil(year, month, day, hour=0, minute=0, second=0):
+    return days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+
+def time_tuple_from_timestamp(timestamp, utc_offset=0):
+    timestamp = int(timestamp) + utc_offset
+    days, secs = divmod(timestamp, 86400)
+    year, month, day = civil_from_days(days)
+    return (year, month, day, secs // 3600, secs % 3600 // 60, secs % 60, weekday_from_days(days))
+
+def rtc_time_us():
+    rtc_tuple = machine.RTC().datetime()
+    seconds = timestamp_from_civil(rtc_tuple[0] + RTC_YEAR_BASE, rtc_tuple[1], rtc_tuple[2], rtc_tuple[4], rtc_tuple[5], rtc_tuple[6])
+    return seconds * 1000000 + rtc_tuple[7]
+
+def set_rtc_us(utc_us):
+    seconds, micros = divmod(utc_us, 1000000)
+    year, month, day, hour, minute, second, weekday = time_tuple_from_timestamp(seconds)
+    adjusted_year_for_rtc = year - RTC_YEAR_BASE
+    if adjusted_year_for_rtc < 0 or adjusted_year_for_rtc > 255:
+        raise ValueError(f"调整后的年份 {year} ({adjusted_year_for_rtc} for RTC) 超出 ESP32 RTC 支持范围 (0-255)。")
+    machine.RTC().datetime((adjusted_year_for_rtc, month, day, weekday, hour, minute, second, micros))
+
+def _queue_read(sock):
+    yield asyncio.core._io_queue.queue_read(sock)
+
+async def wait_readable(sock):
+    if IS_MICROPYTHON:
+        await _queue_read(sock)
+        return
+    loop = asyncio.get_event_loop()
+    ready = loop.create_future()
+    loop.add_reader(sock.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(sock.fileno())
+
+def ntp_timestamp_to_us(seconds, fraction):
+    return (seconds - NTP_DELTA) * 1000000 + ((fraction * 1000000) >> 32)
+
+def resolve_ntp_server(host, addresses):
+    # 解析结果缓存在 addresses 中; 解析失败的名字记为 None, 下一轮跳过, 再下一轮才重新解析
+    if host in addresses:
+        addr = addresses[host]
+        if addr is None:
+            del addresses[host]
+        return addr
+    try:
+        addr = socket.getaddrinfo(host, NTP_PORT)[0][-1]
+    except OSError as e:
+        print(f"解析 NTP 服务器 {host} 失败: {e}")
+        addr = None
+    addresses[host] = addr
+    return addr
+
+async def sntp_query(servers, addresses=None, timeout_ms=NTP_TIMEOUT_MS):
+    if addresses is None:
+        addresses = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    base_us = rtc_time_us()
+    base_ticks = time.ticks_us()
+    pending = {}
+    samples = []
+    packet = bytearray(48)
+    packet[0] = 0x23
+    try:
+        for index, host in enumerate(servers):
+            addr = resolve_ntp_server(host, addresses)
+            if addr is None:
+                continue
+            try:
+                cookie = (index + 1, time.ticks_us())
+                struct.pack_into("!II", packet, 40, cookie[0], cookie[1])
+                t1 = base_us + time.ticks_diff(time.ticks_us(), base_ticks)
+                sock.sendto(packet, addr)
+                pending[cookie] = (host, t1)
+            except OSError as e:
+                print(f"向 NTP 服务器 {host} 发送请求失败: {e}")
+                addresses.pop(host, None)
+
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while pending:
+            remaining = time.ticks_diff(deadline, time.ticks_ms())
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(wait_readable(sock), remaining / 1000)
+                data = sock.recv(48)
+            except asyncio.TimeoutError:
+                break
+            except OSError:
+                continue
+            t4 = base_us + time.ticks_diff(time.ticks_us(), base_ticks)
+            if len(data) < 48:
+                continue
+            entry = pending.pop(struct.unpack_from("!II", data, 24), None)
+            stratum = data[1]
+            if entry is None or data[0] & 0x07 != 4 or stratum < 1 or stratum > 15:
+                continue
+            host, t1 = entry
+            t2 = ntp_timestamp_to_us(*struct.unpack_from("!II", data, 32))
+            t3 = ntp_timestamp_to_us(*struct.unpack_from("!II", data, 40))
+            offset_us = ((t2 - t1) + (t3 - t4)) // 2
+            delay_us = (t4 - t1) - (t3 - t2)
+            print(f"NTP 服务器 {host}: 层级 {stratum}, 偏移 {offset_us} 微秒, 往返延迟 {delay_us} 微秒")
+            samples.append((delay_us, offset_us, host))
+    finally:
+        sock.close()
+
+    for host, t1 in pending.values():
+        print(f"NTP 服务器 {host} 未在 {timeout_ms} 毫秒内响应，下次同步时重新解析")
+        addresses.pop(host, None)
+    return min(samples) if samples else None
+
+class TimeKeeper:
+    def __init__(self):
+        self.synced = False
+        self.last_sync_us = 0
+        self.last_sync_ticks = 0
+        self.last_offset_us = 0
+        self.last_delay_us = 0
+        self.last_server = ""
+        self.drift_ppb = 0
+        self.drift_error_ppb = TIME_DRIFT_INITIAL_ERROR_PPB
+        self.drift_samples = 0
+        self.interval = TIME_SYNC_MIN_INTERVAL
+        self.last_attempt_ticks = None
+        self.failures = 0
+        self.addresses = {}
+
+    def correction_us(self, rtc_us):
+        if not self.synced:
+            return 0
+        return (rtc_us - self.last_sync_us) * self.drift_ppb // 1000000000
+
+    def now_us(self):
+        rtc_us = rtc_time_us()
+        return rtc_us + self.correction_us(rtc_us)
+
+    def estimated_error_us(self):
+        if not self.synced:
+            return None
+        elapsed_us = rtc_time_us() - self.last_sync_us
+        return self.last_delay_us // 2 + abs(elapsed_us) * self.drift_error_ppb // 1000000000
+
+    def seconds_since_sync(self):
+        if not self.synced:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.last_sync_ticks) // 1000
+
+    def retry_interval(self):
+        return min(TIME_SYNC_MIN_INTERVAL << min(self.failures - 1, 16), TIME_SYNC_MAX_INTERVAL)
+
+    def seconds_until_next_attempt(self):
+        if self.last_attempt_ticks is None:
+            return TIME_SYNC_MIN_INTERVAL
+        wait = self.retry_interval() if self.failures else self.interval
+        return wait - time.ticks_diff(time.ticks_ms(), self.last_attempt_ticks) // 1000
+
+    def _sync_failed(self):
+        self.failures += 1
+        if METRICS_ENABLED:
+            g_metrics.ntp_failures += 1
+        print(f"NTP 同步已连续失败 {self.failures} 次，{self.retry_interval()} 秒后重试。")
+        return None
+
+    def _update_drift(self, true_now_us, offset_us):
+        elapsed_us = true_now_us - self.last_sync_us
+        if elapsed_us < TIME_DRIFT_MIN_ELAPSED * 1000000:
+            return
+        sample_ppb = offset_us * 1000000000 // elapsed_us
+        residual_us = offset_us - elapsed_us * self.drift_ppb // 1000000000
+        if self.drift_samples == 0:
+            self.drift_ppb = sample_ppb
+        else:
+            self.drift_error_ppb += (abs(sample_ppb - self.drift_ppb) - self.drift_error_ppb) // 4
+            self.drift_ppb += (sample_ppb - self.drift_ppb) // 4
+        self.drift_samples += 1
+
+        if abs(residual_us) <= TIME_SYNC_SETTLED_US:
+            self.interval = min(self.interval * 2, TIME_SYNC_MAX_INTERVAL)
+        else:
+            self.interval = max(self.interval // 2, TIME_SYNC_MIN_INTERVAL)
+        print(f"RTC 漂移估计: {self.drift_ppb / 1000:.3f} ppm (误差 ±{self.drift_error_ppb / 1000:.3f} ppm)，残差 {residual_us} 微秒，下次同步间隔 {self.interval} 秒")
+
+    async def sync(self):
+        print("正在同步NTP时间...")
+        self.last_attempt_ticks = time.ticks_ms()
+        best = await sntp_query(NTP_SERVERS, self.addresses)
+        if best is None:
+            print("警告：所有 NTP 时间同步尝试均失败。设备时间可能不准确。")
+            print("常见原因：未连接到互联网，或防火墙阻止了UDP端口123。")
+            return self._sync_failed()
+
+        delay_us, offset_us, host = best
+        if METRICS_ENABLED:
+            g_metrics.ntp_offset_us.observe(abs(offset_us))
+        rtc = machine.RTC()
+        print(f"设置 RTC 前读取到的时间: {rtc.datetime()}")
+        true_now_us = rtc_time_us() + offset_us
+        try:
+            set_rtc_us(true_now_us)
+        except ValueError as e:
+            print(f"使用 NTP 服务器 {host} 设置时间时出错: {e}")
+            return self._sync_failed()
+        self.failures = 0
+        if self.synced:
+            self._update_drift(true_now_us, offset_us)
+        self.synced = True
+        self.last_sync_us = true_now_us
+        self.last_sync_ticks = time.ticks_ms()
+        self.last_offset_us = offset_us
+        self.last_delay_us = delay_us
+        self.last_server = host
+        print(f"NTP时间同步成功 (使用服务器 {host}，往返延迟 {delay_us // 1000} 毫秒)。")
+        print(f"设置 RTC 后读取到的时间: {rtc.datetime()}")
+        return best
+
+    async def ensure_synced(self):
+        if self.synced and self.seconds_since_sync() < self.interval:
+            print(f"距上次 NTP 同步仅 {self.seconds_since_sync()} 秒，跳过本次同步。")
+            return
+        await self.sync()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(min(max(self.seconds_until_next_attempt(), 1), TIME_SYNC_MAX_INTERVAL))
+            due = self.last_attempt_ticks is None or self.seconds_until_next_attempt() <= 0
+            if due and network.WLAN(network.STA_IF).isconnected():
+                await self.sync()
+
+    def status(self):
+        return {
+            "synced": self.synced,
+            "utc_us": self.now_us(),
+            "last_offset_us": self.last_offset_us,
+            "last_delay_us": self.last_delay_us,
+            "last_server": self.last_server,
+            "since_sync": self.seconds_since_sync(),
+            "drift_ppb": self.drift_ppb,
+            "error_us": self.estimated_error_us(),
+            "interval": self.interval,
+            "failures": self.failures,
+            "next_sync": self.seconds_until_next_attempt(),
+        }
+
+g_timekeeper = TimeKeeper()
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, lines, name, labels=""):
+        sep = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+
+class Metrics:
+    def __init__(self):
+        self.requests = {}
+        self.latency = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.recv_calls = 0
+        self.send_calls = 0
+        self.scan_ms = Histogram(DURATION_BUCKETS_MS)
+        self.connect_ms = Histogram(DURATION_BUCKETS_MS)
+        self.connect_failures = {}
+        self.ntp_offset_us = Histogram(NTP_OFFSET_BUCKETS_US)
+        self.ntp_failures = 0
+        self.mem_free_min = -1
+        self.mem_alloc_max = 0
+
+    def observe_request(self, method, route, status, elapsed_ms):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = Histogram(LATENCY_BUCKETS_MS)
+        histogram.observe(elapsed_ms)
+
+    def observe_rejected(self, status):
+        key = ("-", "rejected", status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def sample_memory(self):
+        if not hasattr(gc, "mem_free"):
+            return
+        free = gc.mem_free()
+        alloc = gc.mem_alloc()
+        if self.mem_free_min < 0 or free < self.mem_free_min:
+            self.mem_free_min = free
+        if alloc > self.mem_alloc_max:
+            self.mem_alloc_max = alloc
+
+    def render(self):
+        self.sample_memory()
+        lines = ["# TYPE portal_requests_total counter"]
+        for (method, route, status), count in self.requests.items():
+            lines.append(f'portal_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+        lines.append("# TYPE portal_request_duration_ms histogram")
+        for route, histogram in self.latency.items():
+            histogram.render(lines, "portal_request_duration_ms", f'route="{route}"')
+        lines.append("# TYPE portal_bytes_received_total counter")
+        lines.append(f"portal_bytes_received_total {self.bytes_in}")
+        lines.append("# TYPE portal_bytes_sent_total counter")
+        lines.append(f"portal_bytes_sent_total {self.bytes_out}")
+        lines.append("# TYPE portal_recv_calls_total counter")
+        lines.append(f"portal_recv_calls_total {self.recv_calls}")
+        lines.append("# TYPE portal_send_calls_total counter")
+        lines.append(f"portal_send_calls_total {self.send_calls}")
+        lines.append("# TYPE portal_scan_duration_ms histogram")
+        self.scan_ms.render(lines, "portal_scan_duration_ms")
+        lines.append("# TYPE portal_connect_duration_ms histogram")
+        self.connect_ms.render(lines, "portal_connect_duration_ms")
+        lines.append("# TYPE portal_connect_failures_total counter")
+        for reason, count in self.connect_failures.items():
+            lines.append(f'portal_connect_failures_total{{reason="{reason}"}} {count}')
+        lines.append("# TYPE portal_ntp_offset_abs_us histogram")
+        self.ntp_offset_us.render(lines, "portal_ntp_offset_abs_us")
+        lines.append("# TYPE portal_ntp_failures_total counter")
+        lines.append(f"portal_ntp_failures_total {self.ntp_failures}")
+        lines.append("# TYPE portal_ntp_last_offset_us gauge")
+        lines.append(f"portal_ntp_last_offset_us {g_timekeeper.last_offset_us}")
+        lines.append("# TYPE portal_ntp_last_delay_us gauge")
+        lines.append(f"portal_ntp_last_delay_us {g_timekeeper.last_delay_us}")
+        lines.append("# TYPE portal_rtc_drift_ppb gauge")
+        lines.append(f"portal_rtc_drift_ppb {g_timekeeper.drift_ppb}")
+        lines.append("# TYPE portal_startup_phase_ms gauge")
+        for phase, elapsed_ms, total_ms in g_startup.phases:
+            lines.append(f'portal_startup_phase_ms{{phase="{phase}"}} {elapsed_ms}')
+        if hasattr(gc, "mem_free"):
+            lines.append("# TYPE portal_mem_free_bytes gauge")
+            lines.append(f"portal_mem_free_bytes {gc.mem_free()}")
+            lines.append("# TYPE portal_mem_free_min_bytes gauge")
+            lines.append(f"portal_mem_free_min_bytes {self.mem_free_min}")
+            lines.append("# TYPE portal_mem_alloc_bytes gauge")
+            lines.append(f"portal_mem_alloc_bytes {gc.mem_alloc()}")
+            lines.append("# TYPE portal_mem_alloc_max_bytes gauge")
+            lines.append(f"portal_mem_alloc_max_bytes {self.mem_alloc_max}")
+        lines.append("")
+        return "\n".join(lines)
+
+g_metrics = Metrics()
+
+async def set_time():
+    return await g_timekeeper.sync()
+
+
+def get_beijing_time_tuple():
+    return time_tuple_from_timestamp(g_timekeeper.now_us() // 1000000, UTC_OFFSET_SECONDS)[:6]
+
+def get_beijing_timestamp():
+    try:
+        return g_timekeeper.now_us() // 1000000 + UTC_OFFSET_SECONDS
+    except Exception as e:
+        print(f"计算时间戳时出错: {e}")
+        return 0
+
+def format_time(tm_tuple):
+    year, month, day, hour, minute, second = tm_tuple[:6]
+    return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(year, month, day, hour, minute, second)
+
+
+async def wait_until(predicate, timeout_ms, initial_ms=READY_POLL_INITIAL_MS, max_ms=READY_POLL_MAX_MS):
+    started = time.ticks_ms()
+    delay_ms = initial_ms
+    while not predicate():
+        remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), started)
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(delay_ms, remaining) / 1000)
+        delay_ms = min(delay_ms * 2, max_ms)
+    return True
+
+class StartupTimeline:
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+        if IS_MICROPYTHON:
+            # 设备上 ticks_ms() 从复位开始计数, 这段是固件启动到脚本开始执行的耗时
+            self.phases.append(("firmware", started, started))
+            print(f"[启动计时] firmware: {started} 毫秒")
+
+    def mark(self, phase):
+        now = time.ticks_ms()
+        elapsed_ms = time.ticks_diff(now, self.last)
+        total_ms = time.ticks_diff(now, self.started)
+        self.last = now
+        self.phases.append((phase, elapsed_ms, total_ms))
+        print(f"[启动计时] {phase}: {elapsed_ms} 毫秒 (累计 {total_ms} 毫秒)")
+
+g_startup = StartupTimeline(g_boot_ticks)
+
+class RadioController:
+    def __init__(self):
+        self.sta = network.WLAN(network.STA_IF)
+        self.ap = network.WLAN(network.AP_IF)
+
+    def ensure_sta(self):
+        if not self.sta.active():
+            print("激活 STA 接口 (AP+STA 双模式)...")
+            self.sta.active(True)
+        return self.sta
+
+    async def reset(self):
+        self.disconnect_sta()
+        if self.ap.active():
+            self.ap.active(False)
+        return await wait_until(lambda: not self.sta.isconnected() and not self.ap.active(), INTERFACE_RESET_TIMEOUT_MS)
+
+    async def start_ap(self, ssid, password):
+        print(f"正在启动/重启 SoftAP '{ssid}'...")
+        self.ensure_sta()
+        ap = self.ap
+        try:
+            print("配置 AP 参数...")
+            ap.config(essid=ssid, authmode=AP_AUTHMODE, password=password)
+            if not ap.active():
+                print("激活 AP 接口...")
+                ap.active(True)
+
+        except Exception as e:
+            print(f"配置/激活 AP 时出错: {e}。")
+            try:
+                print("尝试回退到开放网络配置...")
+                ap.config(essid=ssid)
+                ap.active(True)
+            except Exception as e2:
+                print(f"回退启动 AP 也失败了: {e2}")
+            return None, None
+
+        print("等待 AP 激活...")
+        if await wait_until(lambda: ap.active() and ap.ifconfig()[0] != "0.0.0.0", AP_ACTIVE_TIMEOUT_MS):
+            ip_address = ap.ifconfig()[0]
+            print(f"SoftAP '{ssid}' 已激活。IP 地址: {ip_address}")
+            return ap, ip_address
+        else:
+            print(f"SoftAP 在 {AP_ACTIVE_TIMEOUT_MS} 毫秒内未能激活。")
+            return None, None
+
+    def move_ap_channel(self, channel):
+        if not channel or not self.ap.active():
+            return
+        try:
+            current = self.ap.config("channel")
+        except Exception:
+            current = None
+        if current == channel:
+            return
+        print(f"将 SoftAP 从信道 {current} 移到目标网络所在的信道 {channel}...")
+        try:
+            self.ap.config(channel=channel)
+        except Exception as e:
+            print(f"切换 SoftAP 信道失败: {e}")
+
+    def scan(self):
+        return self.ensure_sta().scan()
+
+    def disconnect_sta(self):
+        if self.sta.isconnected():
+            print("断开之前的网络连接...")
+            self.sta.disconnect()
+
+g_radio = RadioController()
+
+
+def scan_entry_key(entry):
+    return entry["ssid"] if entry["ssid"] else "#" + entry["bssid"]
+
+def summarize_scan(nets):
+    strongest = {}
+    for net in nets:
+        ssid_bytes, bssid, channel, rssi, authmode, hidden = net[:6]
+        try:
+            ssid = ssid_bytes.decode('utf-8')
+        except UnicodeError:
+            print(f"跳过具有非 UTF-8 SSID 的网络: {ssid_bytes}")
+            continue
+        entry = {
+            "ssid": ssid,
+            "bssid": str(binascii.hexlify(bssid), 'ascii'),
+            "rssi": rssi,
+            "channel": channel,
+            "auth": authmode,
+            "hidden": bool(hidden) or not ssid,
+        }
+        key = scan_entry_key(entry)
+        current = strongest.get(key)
+        if current is None or rssi > current["rssi"]:
+            strongest[key] = entry
+    entries = list(strongest.values())
+    entries.sort(key=lambda entry: entry["rssi"], reverse=True)
+    return entries
+
+async def scan_wifi_networks():
+    print("正在扫描 WiFi 网络...")
+    try:
+        entries = summarize_scan(g_radio.scan())
+        print(f"扫描完成。找到 {len(entries)} 个唯一网络。")
+        return entries
+    except Exception as e:
+        print(f"WiFi 扫描期间出错: {e}")
+        return []
+
+def find_scan_entry(ssid):
+    for entry in g_scan_results or ():
+        if entry["ssid"] == ssid:
+            return entry
+    return None
+
+def scan_changes_since(version):
+    if version == g_scan_version:
+        return [], []
+    previous = g_scan_history.get(version)
+    if previous is None:
+        return None, None
+    changed = []
+    current_keys = {}
+    for entry in g_scan_results:
+        key = scan_entry_key(entry)
+        current_keys[key] = True
+        old = previous.get(key)
+        if old is None or old["bssid"] != entry["bssid"] or old["channel"] != entry["channel"] or old["auth"] != entry["auth"] or abs(old["rssi"] - entry["rssi"]) >= SCAN_RSSI_CHANGE_DB:
+            changed.append(entry)
+    removed = [key for key in previous if key not in current_keys]
+    return changed, removed
+
+def json_compact(obj):
+    try:
+        return json.dumps(obj, separators=(',', ':'))
+    except TypeError:
+        return json.dumps(obj)
+
+async def send_scan_results(response, query_string):
+    params = parse_form_data(query_string)
+    entries = await get_scan_results(refresh=params.get("cached") != "1")
+    since = params.get("since", "")
+    changed, removed = None, None
+    if since:
+        try:
+            changed, removed = scan_changes_since(int(since))
+        except ValueError:
+            pass
+    full = changed is None
+    if full:
+        changed, removed = entries, []
+
+    await response.start_stream(200, CONTENT_TYPE_JSON, CACHE_NO_STORE)
+    pending = f'{{"version":{g_scan_version},"age":{scan_cache_age_ms() // 1000},"full":{"true" if full else "false"},"removed":{json_compact(removed)},"networks":['
+    for index, entry in enumerate(changed):
+        pending += ("," if index else "") + json_compact(entry)
+        if len(pending) >= SEND_CHUNK_SIZE:
+            await response.write_chunk(pending)
+            pending = ""
+    await response.write_chunk(pending + "]}")
+    await response.end_stream()
+
+def trigger_scan_refresh():
+    global g_scan_event
+    if g_scan_event is None:
+        g_scan_event = asyncio.Event()
+        asyncio.create_task(_refresh_scan_cache(g_scan_event))
+    return g_scan_event
+
+async def _refresh_scan_cache(event):
+    global g_scan_results, g_scan_ticks, g_scan_event, g_scan_version
+    try:
+        async with g_radio_lock:
+            started = time.ticks_ms()
+            entries = await scan_wifi_networks()
+            if METRICS_ENABLED:
+                g_metrics.scan_ms.observe(time.ticks_diff(time.ticks_ms(), started))
+            if g_scan_results is not None:
+                g_scan_history.clear()
+                g_scan_history[g_scan_version] = dict((scan_entry_key(entry), entry) for entry in g_scan_results)
+            g_scan_results = entries
+            g_scan_version += 1
+            g_scan_ticks = time.ticks_ms()
+            publish_event("scan", json_compact({"version": g_scan_version, "count": len(entries)}))
+    except Exception as e:
+        print(f"刷新扫描缓存时出错: {e}")
+    finally:
+        g_scan_event = None
+        event.set()
+
+def scan_cache_age_ms():
+    return time.ticks_diff(time.ticks_ms(), g_scan_ticks)
+
+async def get_scan_results(refresh=True):
+    if g_scan_results is None:
+        await trigger_scan_refresh().wait()
+        return g_scan_results if g_scan_results is not None else []
+    if refresh and scan_cache_age_ms() > SCAN_CACHE_TTL * 1000:
+        print("扫描缓存已过期，返回旧结果并在后台刷新...")
+        trigger_scan_refresh()
+    return g_scan_results
+
+
+def _hex_digit(c):
+    if 48 <= c <= 57:
+        return c - 48
+    if 65 <= c <= 70:
+        return c - 55
+    if 97 <= c <= 102:
+        return c - 87
+    return -1
+
+def form_unquote(data, start=0, end=None):
+    if end is None:
+        end = len(data)
+    if data.find(b'%', start, end) < 0 and data.find(b'+', start, end) < 0:
+        return str(data[start:end], 'utf-8')
+    out = bytearray(end - start)
+    n = 0
+    i = start
+    while i < end:
+        c = data[i]
+        if c == 43:
+            c = 32
+        elif c == 37 and i + 2 < end:
+            hi = _hex_digit(data[i + 1])
+            lo = _hex_digit(data[i + 2])
+            if hi >= 0 and lo >= 0:
+                c = (hi << 4) | lo
+                i += 2
+        out[n] = c
+        n += 1
+        i += 1
+    return str(memoryview(out)[:n], 'utf-8')
+
+def parse_form_data(encoded_data):
+    if isinstance(encoded_data, str):
+        encoded_data = encoded_data.encode('utf-8')
+    elif not isinstance(encoded_data, bytes):
+        encoded_data = bytes(encoded_data)
+    data = {}
+    length = len(encoded_data)
+    pos = 0
+    try:
+        while pos < length:
+            amp = encoded_data.find(b'&', pos)
+            if amp < 0:
+                amp = length
+            eq = encoded_data.find(b'=', pos, amp)
+            if eq >= 0:
+                data[form_unquote(encoded_data, pos, eq)] = form_unquote(encoded_data, eq + 1, amp)
+            pos = amp + 1
+    except UnicodeError:
+        raise HttpError(400, "表单数据不是有效的 UTF-8")
+    return data
+
+def html_escape(text):
+    return text.replace("&", "&amp;").replace('"', "&quot;").replace("<", "&lt;").replace(">", "&gt;")
+
+def generate_initial_html(error_msg="", pre_selected_ssid="", job_id=None):
+    pre_selected_ssid_str = html_escape(str(pre_selected_ssid)) if pre_selected_ssid is not None else ""
+    pending_job = str(job_id) if job_id is not None else ""
+    
+    error_div = f'<div id="error-message" style="color:red; background-color: #ffebee; padding: 10px; border-radius: 4px; margin-bottom: 15px;">{error_msg}</div>' if error_msg else ""
+    
+    html_content = f"""<!DOCTYPE html>
+<html>
+<head>
+    <title>ESP32 WiFi 配置</title>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link rel="stylesheet" href="{asset_url('portal.css')}">
+    <script src="{asset_url('portal.js')}" defer></script>
+</head>
+<body data-pending-job="{pending_job}" data-ssid="{pre_selected_ssid_str}" data-scan-interval="{SCAN_CACHE_TTL * 1000}">
+    <h1>ESP32 WiFi 配置</h1>
+
+    {error_div}
+
+    <div id="scan-connect-section">
+        <h3>正在扫描网络...</h3>
+        <form id="wifi-form">
+            <label for="ssid-select">选择网络:</label>
+            <select name="ssid" id="ssid-select">
+                <option value="">-- 请选择 --</option>
+            </select><br><br>
+
+            <div id="password-field" style="display:none;">
+                <label for="password-input">密码:</label>
+                <input type="password" name="password" id="password-input"><br><br>
+            </div>
+
+            <button type="submit">连接</button>
+        </form>
+        <div id="status">正在连接网络...</div>
+        <ul id="network-list"></ul>
+    </div>
+</body>
+</html>"""
+    return html_content
+
+def generate_success_html(device_ip):
+
+    current_time = format_time(get_beijing_time_tuple())
+
+    html_content = f"""<!DOCTYPE html>
+<html>
+<head>
+    <title>ESP32 WiFi 配置 - 成功</title>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link rel="stylesheet" href="{asset_url('portal.css')}">
+    <script src="{asset_url('success.js')}" defer></script>
+</head>
+<body>
+    <div id="success-section">
+        <h2>成功!</h2>
+        <p>已成功连接到 WiFi 网络。</p>
+        <p>您的 ESP32 新 IP 地址是: <strong>{device_ip}</strong></p>
+        <p>当前北京时间是: <strong id='time-display'>{current_time}</strong></p>
+        <a href="/">返回网络选择</a>
+    </div>
+</body>
+</html>"""
+    return html_content
+
+def generate_error_html(message, pre_selected_ssid=""):
+    pre_selected_ssid_str = str(pre_selected_ssid) if pre_selected_ssid is not None else ""
+    return generate_initial_html(error_msg=message, pre_selected_ssid=pre_selected_ssid)
+
+def gzip_compress(data):
+    try:
+        import gzip
+        return gzip.compress(data)
+    except ImportError:
+        pass
+    try:
+        import io
+        import deflate
+        stream = io.BytesIO()
+        compressor = deflate.DeflateIO(stream, deflate.GZIP)
+        compressor.write(data)
+        compressor.close()
+        return stream.getvalue()
+    except Exception as e:
+        print(f"无法生成 gzip 压缩版本: {e}")
+        return None
+
+def make_etag(data):
+    return '"' + str(binascii.hexlify(hashlib.sha256(data).digest()[:8]), 'ascii') + '"'
+
+class StaticPage:
+    def __init__(self, body, content_type=CONTENT_TYPE_HTML):
+        self.body = body
+        self.content_type = content_type
+        self.etag = make_etag(body)
+        self.gzipped = gzip_compress(body)
+        if self.gzipped is not None and len(self.gzipped) >= len(body):
+            self.gzipped = None
+        self.not_modified_headers = b"ETag: " + self.etag.encode() + b"\r\n"
+        self.headers = self.not_modified_headers + CACHE_NO_CACHE + b"Vary: Accept-Encoding\r\n"
+        self.gzip_headers = self.headers + CONTENT_ENCODING_GZIP
+
+def hash_file(path, chunk):
+    digest = hashlib.sha256()
+    mv = memoryview(chunk)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(chunk)
+            if not n:
+                break
+            digest.update(mv[:n])
+    return str(binascii.hexlify(digest.digest()[:8]), 'ascii')
+
+class StaticAsset:
+    def __init__(self, name, digest, path, size, gzip_path=None, gzip_size=0):
+        stem, ext = name.rsplit(".", 1)
+        self.url = f"{ASSET_URL_PREFIX}{stem}.{digest}.{ext}"
+        self.content_type = ASSET_CONTENT_TYPES[ext]
+        self.path = path
+        self.size = size
+        self.gzip_path = gzip_path
+        self.gzip_size = gzip_size
+        self.etag = '"' + digest + '"'
+        self.not_modified_headers = b"ETag: " + self.etag.encode() + b"\r\n"
+        self.headers = self.not_modified_headers + CACHE_IMMUTABLE + b"Vary: Accept-Encoding\r\n"
+        self.gzip_headers = self.headers + CONTENT_ENCODING_GZIP
+
+def load_static_assets():
+    g_assets.clear()
+    try:
+        with open(ASSET_DIR + "/" + ASSET_MANIFEST) as f:
+            manifest = json.load(f)
+        for name, entry in manifest.items():
+            gzip_file = entry.get("gzip_file")
+            g_assets[name] = StaticAsset(name, entry["hash"], ASSET_DIR + "/" + entry["file"], entry["size"],
+                                         ASSET_DIR + "/" + gzip_file if gzip_file else None, entry.get("gzip_size", 0))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"未找到预构建的静态资源 ({e})，改用 {ASSET_SOURCE_DIR}/ 中的源文件 (未压缩)")
+        g_assets.clear()
+        chunk = bytearray(SEND_CHUNK_SIZE)
+        for name in ASSET_SOURCES:
+            path = ASSET_SOURCE_DIR + "/" + name
+            try:
+                g_assets[name] = StaticAsset(name, hash_file(path, chunk), path, os.stat(path)[6])
+            except OSError as e:
+                print(f"静态资源 {path} 不可用: {e}")
+    for url in g_asset_paths:
+        ROUTES.pop(("GET", url), None)
+    g_asset_paths.clear()
+    for asset in g_assets.values():
+        g_asset_paths[asset.url] = asset
+        ROUTES[("GET", asset.url)] = route_static_asset
+    print(f"已加载 {len(g_assets)} 个静态资源: " + ", ".join(f"{asset.url} ({asset.size}/{asset.gzip_size or '-'} 字节)" for asset in g_assets.values()))
+
+def asset_url(name):
+    asset = g_assets.get(name)
+    return asset.url if asset is not None else ASSET_URL_PREFIX + name
+
+def prepare_static_pages():
+    global g_index_page
+    load_static_assets()
+    g_index_page = StaticPage(generate_initial_html().encode('utf-8'))
+    gzipped = g_index_page.gzipped
+    print(f"首页已预渲染: {len(g_index_page.body)} 字节, gzip: {len(gzipped) if gzipped else '不可用'} 字节")
+
+async def send_static_page(response, request, page):
+    if request.header_equals("if-none-match", page.etag):
+        await response.send(304, extra_headers=page.not_modified_headers)
+    elif page.gzipped is not None and request.header_contains("accept-encoding", b"gzip"):
+        await response.send(200, page.gzipped, page.content_type, page.gzip_headers)
+    else:
+        await response.send(200, page.body, page.content_type, page.headers)
+
+async def send_static_asset(response, request, asset):
+    if request.header_equals("if-none-match", asset.etag):
+        await response.send(304, extra_headers=asset.not_modified_headers)
+    elif asset.gzip_path is not None and request.header_contains("accept-encoding", b"gzip"):
+        await response.send_file(200, asset.gzip_path, asset.gzip_size, asset.content_type, asset.gzip_headers)
+    else:
+        await response.send_file(200, asset.path, asset.size, asset.content_type, asset.headers)
+
+class HttpError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message or str(status))
+        self.status = status
+
+async def stream_readinto(reader, mv):
+    if hasattr(reader, 'readinto'):
+        n = await reader.readinto(mv)
+    else:
+        data = await reader.read(len(mv))
+        n = len(data)
+        mv[:n] = data
+    if METRICS_ENABLED:
+        g_metrics.recv_calls += 1
+        g_metrics.bytes_in += n or 0
+    return n
+
+class RequestParser:
+    def __init__(self, buffer_size=REQUEST_BUFFER_SIZE):
+        self.buf = bytearray(buffer_size)
+        self.mv = memoryview(self.buf)
+        self.header_values = [None] * len(HEADER_WHITELIST)
+        self.reset()
+
+    def reset(self):
+        self.filled = 0
+        self.scan_pos = 0
+        self.line_start = 0
+        self.head_end = 0
+        self.consumed = 0
+        self.body_done = False
+        self.method = None
+        self.path = ""
+        self.query_string = ""
+        self.version = "HTTP/1.0"
+        values = self.header_values
+        i = 0
+        while i < len(values):
+            values[i] = None
+            i += 1
+
+    def _find(self, start, end, byte):
+        buf = self.buf
+        while start < end and buf[start] != byte:
+            start += 1
+        return start
+
+    def _equals(self, start, end, data):
+        if end - start != len(data):
+            return False
+        buf = self.buf
+        i = 0
+        while i < len(data) and buf[start + i] | 0x20 == data[i] | 0x20:
+            i += 1
+        return i == len(data)
+
+    def _on_request_line(self, start, end):
+        sp1 = self._find(start, end, 32)
+        sp2 = self._find(sp1 + 1, end, 32)
+        if sp1 >= end or sp2 == sp1 + 1:
+            raise HttpError(400, "无效的请求行")
+        method = None
+        for index, name in enumerate(HTTP_METHODS_BYTES):
+            if self._equals(start, sp1, name):
+                method = HTTP_METHODS[index]
+                break
+        question = self._find(sp1 + 1, sp2, 63)
+        try:
+            self.method = method or str(self.mv[start:sp1], 'utf-8')
+            self.path = str(self.mv[sp1 + 1:question], 'utf-8')
+            if question < sp2:
+                self.query_string = str(self.mv[question + 1:sp2], 'utf-8')
+        except UnicodeError:
+            raise HttpError(400, "请求行不是有效的 UTF-8")
+        if sp2 < end and self._equals(sp2 + 1, end, b"http/1.1"):
+            self.version = "HTTP/1.1"
+
+    def _on_line(self, start, end):
+        if self.method is None:
+            self._on_request_line(start, end)
+            return
+        colon = self._find(start, end, 58)
+        if colon >= end:
+            return
+        name_end = colon
+        while name_end > start and self.buf[name_end - 1] in (32, 9):
+            name_end -= 1
+        for index, name in enumerate(HEADER_WHITELIST_BYTES):
+            if self._equals(start, name_end, name):
+                value_start = colon + 1
+                while value_start < end and self.buf[value_start] in (32, 9):
+                    value_start += 1
+                value_end = end
+                while value_end > value_start and self.buf[value_end - 1] in (32, 9):
+                    value_end -= 1
+                self.header_values[index] = self.mv[value_start:value_end]
+                return
+
+    def header_value(self, name):
+        return self.header_values[HEADER_WHITELIST.index(name)]
+
+    def header(self, name, default=None):
+        value = self.header_value(name)
+        if value is None:
+            return default
+        try:
+            return str(value, 'utf-8')
+        except UnicodeError:
+            raise HttpError(400, "请求头不是有效的 UTF-8")
+
+    def header_equals(self, name, text):
+        value = self.header_value(name)
+        if value is None or len(value) != len(text):
+            return False
+        i = 0
+        while i < len(text) and value[i] == ord(text[i]):
+            i += 1
+        return i == len(text)
+
+    def header_contains(self, name, token):
+        value = self.header_value(name)
+        if value is None:
+            return False
+        last = len(value) - len(token)
+        start = 0
+        while start <= last:
+            i = 0
+            while i < len(token) and value[start + i] | 0x20 == token[i]:
+                i += 1
+            if i == len(token):
+                return True
+            start += 1
+        return False
+
+    def parse(self):
+        buf = self.buf
+        i = self.scan_pos
+        while i < self.filled:
+            if buf[i] == 10:
+                end = i - 1 if i > self.line_start and buf[i - 1] == 13 else i
+                if end > self.line_start:
+                    self._on_line(self.line_start, end)
+                elif self.method is not None:
+                    self.head_end = i + 1
+                    self.consumed = i + 1
+                    self.scan_pos = i + 1
+                    return True
+                self.line_start = i + 1
+            elif self.method is None and i - self.line_start >= MAX_REQUEST_LINE:
+                raise HttpError(414, "请求行超过 {} 字节".format(MAX_REQUEST_LINE))
+            i += 1
+        self.scan_pos = i
+        return False
+
+    async def read_head(self, reader):
+        while not self.parse():
+            if self.filled >= len(self.buf):
+                raise HttpError(431, "请求头超过 {} 字节".format(len(self.buf)))
+            n = await stream_readinto(reader, self.mv[self.filled:])
+            if not n:
+                return False
+            self.filled += n
+        return True
+
+    def content_length(self):
+        value = self.header_value("content-length")
+        if value is None:
+            return None
+        if not len(value):
+            raise HttpError(400, "Content-Length 无效")
+        length = 0
+        for c in value:
+            if c < 48 or c > 57:
+                raise HttpError(400, "Content-Length 无效")
+            length = length * 10 + c - 48
+            if length > MAX_CONTENT_LENGTH:
+                raise HttpError(413, "Content-Length 超过 {} 字节".format(MAX_CONTENT_LENGTH))
+        return length
+
+    def wants_keep_alive(self):
+        if self.header_value("transfer-encoding") is not None:
+            return False
+        if self.version == "HTTP/1.1":
+            return not self.header_contains("connection", b"close")
+        return self.header_contains("connection", b"keep-alive")
+
+    async def _fill(self, reader, end):
+        while self.filled < end:
+            try:
+                n = await stream_readinto(reader, self.mv[self.filled:])
+            except OSError:
+                return False
+            if not n:
+                return False
+            self.filled += n
+        return True
+
+    async def read_body(self, reader, length):
+        end = self.head_end + length
+        if end > len(self.buf):
+            raise HttpError(413, "请求超过 {} 字节的内存预算".format(len(self.buf)))
+        self.body_done = True
+        try:
+            if not await asyncio.wait_for(self._fill(reader, end), BODY_TIMEOUT):
+                return None
+        except asyncio.TimeoutError:
+            raise HttpError(408, "请求体未在 {} 秒内收完".format(BODY_TIMEOUT))
+        self.consumed = end
+        return self.mv[self.head_end:end]
+
+    async def _skip(self, reader, remaining):
+        while remaining > 0:
+            n = await stream_readinto(reader, self.mv[:min(remaining, len(self.buf))])
+            if not n:
+                return False
+            remaining -= n
+        return True
+
+    async def discard_body(self, reader):
+        if self.body_done:
+            return True
+        self.body_done = True
+        remaining = (self.content_length() or 0) - (self.filled - self.head_end)
+        if remaining <= 0:
+            self.consumed = self.head_end + (self.content_length() or 0)
+            return True
+        self.filled = self.consumed = 0
+        try:
+            return await asyncio.wait_for(self._skip(reader, remaining), BODY_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+
+    def next_request(self):
+        leftover = self.filled - self.consumed
+        if leftover > 0:
+            self.mv[:leftover] = self.mv[self.consumed:self.filled]
+        self.reset()
+        self.filled = max(leftover, 0)
+
+class ResponseWriter:
+    def __init__(self, send_buffer_size=SEND_BUFFER_SIZE):
+        self.buf = bytearray(send_buffer_size)
+        self.mv = memoryview(self.buf)
+        self.reset(None)
+
+    def reset(self, writer, http11=True, keep_alive=False):
+        self.writer = writer
+        self.http11 = http11
+        self.keep_alive = keep_alive
+        self.headers_sent = False
+        self.chunked = False
+        self.status = 0
+
+    async def _write_all(self, data):
+        mv = memoryview(data)
+        total = len(mv)
+        offset = 0
+        while offset < total:
+            end = min(offset + SEND_CHUNK_SIZE, total)
+            self.writer.write(mv[offset:end])
+            if self._must_drain():
+                await asyncio.wait_for(self.writer.drain(), SEND_TIMEOUT)
+            if METRICS_ENABLED:
+                g_metrics.send_calls += 1
+                g_metrics.bytes_out += end - offset
+            offset = end
+
+    def _must_drain(self):
+        # CPython 的 transport.write() 在对端断开后不会抛异常, 只有 drain() 会报告连接已断开
+        transport = getattr(self.writer, "transport", None)
+        if transport is not None:
+            return transport.get_write_buffer_size() > 0 or transport.is_closing()
+        if hasattr(self.writer, "out_buf"):
+            return len(self.writer.out_buf) > 0
+        return True
+
+    def _put(self, pos, data):
+        end = pos + len(data)
+        self.mv[pos:end] = data
+        return end
+
+    def _put_int(self, pos, value):
+        buf = self.buf
+        start = pos
+        while True:
+            buf[pos] = 48 + value % 10
+            value //= 10
+            pos += 1
+            if not value:
+                break
+        i, j = start, pos - 1
+        while i < j:
+            buf[i], buf[j] = buf[j], buf[i]
+            i += 1
+            j -= 1
+        return pos
+
+    def _head(self, status, content_type, extra_headers, length):
+        self.status = status
+        pos = self._put(0, HTTP_STATUS_LINES[status])
+        if content_type:
+            pos = self._put(pos, content_type)
+        if length is not None:
+            pos = self._put(pos, b"Content-Length: ")
+            pos = self._put_int(pos, length)
+            pos = self._put(pos, b"\r\n")
+        elif self.chunked:
+            pos = self._put(pos, b"Transfer-Encoding: chunked\r\n")
+        if extra_headers:
+            pos = self._put(pos, extra_headers.encode('utf-8') if isinstance(extra_headers, str) else extra_headers)
+        return self._put(pos, KEEP_ALIVE_HEADERS if self.keep_alive else CLOSE_HEADERS)
+
+    async def send(self, status, body=b"", content_type=None, extra_headers=b""):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        pos = self._head(status, content_type, extra_headers, None if status == 304 else len(body))
+        self.headers_sent = True
+        if pos + len(body) <= len(self.buf):
+            pos = self._put(pos, body)
+            await self._write_all(self.mv[:pos])
+        else:
+            await self._write_all(self.mv[:pos])
+            await self._write_all(body)
+
+    async def send_file(self, status, path, size, content_type=None, extra_headers=b""):
+        with open(path, "rb") as f:
+            pos = self._head(status, content_type, extra_headers, size)
+            self.headers_sent = True
+            mv = self.mv
+            sent = 0
+            while True:
+                n = f.readinto(mv[pos:]) or 0
+                sent += n
+                pos += n
+                if pos:
+                    await self._write_all(mv[:pos])
+                if not n or sent >= size:
+                    break
+                pos = 0
+        if sent != size:
+            print(f"文件 {path} 长度与预期不符 ({sent}/{size} 字节)，关闭连接")
+            self.keep_alive = False
+
+    async def start_stream(self, status, content_type=None, extra_headers=b""):
+        self.chunked = self.http11
+        if not self.chunked:
+            self.keep_alive = False
+        self.headers_sent = True
+        await self._write_all(self.mv[:self._head(status, content_type, extra_headers, None)])
+
+    async def write_chunk(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not data:
+            return
+        if not self.chunked:
+            await self._write_all(data)
+            return
+        size_line = ("%x\r\n" % len(data)).encode()
+        if len(size_line) + len(data) + 2 <= len(self.buf):
+            pos = self._put(0, size_line)
+            pos = self._put(pos, data)
+            pos = self._put(pos, b"\r\n")
+            await self._write_all(self.mv[:pos])
+        else:
+            await self._write_all(size_line)
+            await self._write_all(data)
+            await self._write_all(b"\r\n")
+
+    async def end_stream(self):
+        if self.chunked:
+            await self._write_all(b"0\r\n\r\n")
+
+class ConnectionSlot:
+    def __init__(self):
+        self.request = RequestParser()
+        self.response = ResponseWriter()
+
+g_free_slots = [ConnectionSlot() for _ in range(MAX_CONNECTION_SLOTS)]
+SLOTS_EXHAUSTED_RESPONSE = HTTP_STATUS_LINES[503] + b"Content-Length: 0\r\nRetry-After: 1\r\n" + CLOSE_HEADERS
+
+class EventSubscriber:
+    def __init__(self):
+        self.pending = []
+        self.ready = asyncio.Event()
+        self.closed = False
+
+    async def watch_disconnect(self, reader):
+        try:
+            await reader.read(1)
+        except Exception:
+            pass
+        self.closed = True
+        self.ready.set()
+
+    def push(self, name, data):
+        if len(self.pending) < MAX_PENDING_EVENTS:
+            self.pending.append((name, data))
+            self.ready.set()
+
+def publish_event(name, data):
+    for subscriber in g_event_subscribers:
+        subscriber.push(name, data)
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {data}\n\n"
+
+def time_event_data():
+    return json_compact({"utc_us": g_timekeeper.now_us(), "beijing": format_time(get_beijing_time_tuple()), "synced": g_timekeeper.synced})
+
+async def send_events(reader, response):
+    if len(g_event_subscribers) >= MAX_EVENT_STREAMS:
+        await response.send(503, extra_headers=RETRY_AFTER_EVENTS)
+        return
+
+    subscriber = EventSubscriber()
+    g_event_subscribers.append(subscriber)
+    response.keep_alive = False
+    watcher = asyncio.create_task(subscriber.watch_disconnect(reader))
+    try:
+        await response.start_stream(200, CONTENT_TYPE_EVENTS, CACHE_NO_CACHE)
+        initial = "retry: 3000\n\n" + format_event("time", time_event_data())
+        if g_jobs:
+            initial += format_event("wifi", job_to_json(g_jobs[max(g_jobs)]))
+        await response.write_chunk(initial)
+        while True:
+            wait_ms = 1000 - (g_timekeeper.now_us() // 1000) % 1000
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), wait_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            if subscriber.closed:
+                break
+
+            if subscriber.pending:
+                payload = "".join(format_event(name, data) for name, data in subscriber.pending)
+                subscriber.pending = []
+                subscriber.ready.clear()
+            else:
+                payload = format_event("time", time_event_data())
+            await response.write_chunk(payload)
+    finally:
+        watcher.cancel()
+        g_event_subscribers.remove(subscriber)
+
+def set_job_state(job, state):
+    if job is not None:
+        job["state"] = state
+        print(f"\n连接任务 {job['id']} 状态: {state}")
+        publish_event("wifi", job_to_json(job))
+
+async def attempt_wifi_connection(ssid, password, job=None):
+    if g_radio_lock.locked():
+        print("另一个连接尝试正在进行，等待其完成...")
+    async with g_radio_lock:
+        return await _connect_sta(ssid, password, job)
+
+async def wait_for_association(sta_if, timeout_ms):
+    started = time.ticks_ms()
+    delay_ms = READY_POLL_INITIAL_MS
+    last_status = None
+    while True:
+        status = sta_if.status()
+        if status != last_status:
+            print(f"STA 状态: {status} ({time.ticks_diff(time.ticks_ms(), started)} 毫秒)")
+            last_status = status
+        if status == STA_STATUS_GOT_IP or sta_if.isconnected():
+            return None
+        reason = STA_FAILURE_REASONS.get(status)
+        if reason is not None:
+            return reason
+        remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), started)
+        if remaining <= 0:
+            return "timeout"
+        await asyncio.sleep(min(delay_ms, remaining) / 1000)
+        delay_ms = min(delay_ms * 2, READY_POLL_MAX_MS)
+
+async def _connect_sta(ssid, password, job=None):
+    print(f"正在尝试连接到 WiFi: '{ssid}'...")
+    set_job_state(job, JOB_ASSOCIATING)
+    sta_if = g_radio.ensure_sta()
+    g_radio.disconnect_sta()
+    target = find_scan_entry(ssid)
+    if target is not None:
+        g_radio.move_ap_channel(target["channel"])
+
+    print(f"开始连接，最多等待 {WIFI_CONNECT_TIMEOUT} 秒...")
+    started = time.ticks_ms()
+    backoff_ms = CONNECT_RETRY_BACKOFF_MS
+    attempt = 0
+    while True:
+        sta_if.connect(ssid, password)
+        remaining = WIFI_CONNECT_TIMEOUT * 1000 - time.ticks_diff(time.ticks_ms(), started)
+        reason = await wait_for_association(sta_if, remaining)
+        if reason is None:
+            break
+        sta_if.disconnect()
+        remaining = WIFI_CONNECT_TIMEOUT * 1000 - time.ticks_diff(time.ticks_ms(), started)
+        if reason not in TRANSIENT_CONNECT_FAILURES or attempt >= CONNECT_MAX_RETRIES or remaining <= backoff_ms:
+            break
+        attempt += 1
+        print(f"连接失败 ({reason})，{backoff_ms} 毫秒后进行第 {attempt} 次重试...")
+        set_job_state(job, JOB_RETRYING)
+        await asyncio.sleep(backoff_ms / 1000)
+        backoff_ms *= 2
+        set_job_state(job, JOB_ASSOCIATING)
+
+    if reason is None:
+        print(f"已成功连接到 WiFi！用时 {time.ticks_diff(time.ticks_ms(), started)} 毫秒")
+        if METRICS_ENABLED:
+            g_metrics.connect_ms.observe(time.ticks_diff(time.ticks_ms(), started))
+        ifconfig_tuple = sta_if.ifconfig()
+        device_ip_on_home_network = ifconfig_tuple[0]
+        if job is not None:
+            job["ip"] = device_ip_on_home_network
+        set_job_state(job, JOB_GOT_IP)
+        set_job_state(job, JOB_NTP_SYNCING)
+        await g_timekeeper.ensure_synced()
+        print("网络配置:", ifconfig_tuple)
+        return True, device_ip_on_home_network, None
+    else:
+        print(f"连接到 WiFi '{ssid}' 失败 ({reason})，用时 {time.ticks_diff(time.ticks_ms(), started)} 毫秒。")
+        if METRICS_ENABLED:
+            g_metrics.connect_failures[reason] = g_metrics.connect_failures.get(reason, 0) + 1
+        return False, "", reason
+
+class ProfileStore:
+    def __init__(self, path=CREDENTIALS_FILE):
+        self.path = path
+        self.profiles = None
+        self.sequence = 0
+
+    def load(self):
+        if self.profiles is not None:
+            return self.profiles
+        self.profiles = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self.profiles
+        if data.get("ssid"):
+            data = {"profiles": {data["ssid"]: data}}
+        for ssid, profile in data.get("profiles", {}).items():
+            profile["ssid"] = ssid
+            profile.setdefault("password", "")
+            profile.setdefault("priority", 0)
+            profile.setdefault("last_used", 0)
+            self.profiles[ssid] = profile
+            self.sequence = max(self.sequence, profile["last_used"])
+        return self.profiles
+
+    def save(self):
+        temp_file = self.path + ".tmp"
+        try:
+            with open(temp_file, "w") as f:
+                json.dump({"profiles": self.load()}, f)
+            try:
+                os.rename(temp_file, self.path)
+            except OSError:
+                os.remove(self.path)
+                os.rename(temp_file, self.path)
+            print(f"已将 {len(self.profiles)} 个网络配置保存到 {self.path}")
+        except OSError as e:
+            print(f"保存网络配置失败: {e}")
+
+    def get(self, ssid):
+        return self.load().get(ssid)
+
+    def add(self, ssid, password=None, priority=None):
+        profiles = self.load()
+        profile = profiles.get(ssid)
+        if profile is None:
+            if len(profiles) >= MAX_PROFILES:
+                evicted = min(profiles.values(), key=lambda p: (p["priority"], p["last_used"]))
+                print(f"网络配置已满 ({MAX_PROFILES} 个)，移除 '{evicted['ssid']}'")
+                del profiles[evicted["ssid"]]
+            profile = profiles[ssid] = {"ssid": ssid, "password": "", "priority": 0, "bssid": "", "channel": 0, "ifconfig": [], "last_used": 0}
+        if password is not None:
+            profile["password"] = password
+        if priority is not None:
+            profile["priority"] = priority
+        return profile
+
+    def remove(self, ssid):
+        if self.load().pop(ssid, None) is None:
+            return False
+        self.save()
+        return True
+
+    def remember(self, ssid, password, sta_if):
+        profile = self.add(ssid)
+        link = {"password": password, "bssid": "", "channel": 0, "ifconfig": list(sta_if.ifconfig())}
+        best = find_scan_entry(ssid)
+        if best is not None:
+            link["bssid"] = best["bssid"]
+            link["channel"] = best["channel"]
+        try:
+            link["channel"] = sta_if.config('channel')
+        except Exception:
+            pass
+        unchanged = profile["last_used"] == self.sequence and profile["last_used"] and all(profile.get(key) == value for key, value in link.items())
+        if unchanged:
+            return
+        profile.update(link)
+        self.sequence += 1
+        profile["last_used"] = self.sequence
+        self.save()
+
+    def most_recent(self):
+        profiles = self.load()
+        if not profiles:
+            return None
+        return max(profiles.values(), key=lambda p: p["last_used"])
+
+    def ranked(self, entries):
+        profiles = self.load()
+        candidates = []
+        for entry in entries:
+            profile = profiles.get(entry["ssid"])
+            if profile is not None:
+                candidates.append((profile, entry))
+        candidates.sort(key=lambda candidate: (candidate[0]["priority"], candidate[1]["rssi"]), reverse=True)
+        return candidates
+
+    def to_json(self):
+        rssi_by_ssid = dict((entry["ssid"], entry["rssi"]) for entry in g_scan_results or ())
+        items = [{"ssid": p["ssid"], "priority": p["priority"], "last_used": p["last_used"], "has_password": bool(p["password"]), "rssi": rssi_by_ssid.get(p["ssid"])} for p in self.load().values()]
+        items.sort(key=lambda item: (item["priority"], item["last_used"]), reverse=True)
+        return json.dumps({"profiles": items})
+
+g_profiles = ProfileStore()
+
+async def connect_profile(profile, timeout_ms, bssid_hex="", channel=0):
+    ssid = profile["ssid"]
+    sta_if = g_radio.ensure_sta()
+    g_radio.disconnect_sta()
+    if channel:
+        try:
+            sta_if.config(channel=channel)
+        except Exception:
+            pass
+    static_ip = FAST_RECONNECT_STATIC_IP and profile.get("ifconfig") and profile["ifconfig"][0] != "0.0.0.0"
+    if static_ip:
+        sta_if.ifconfig(tuple(profile["ifconfig"]))
+
+    bssid = binascii.unhexlify(bssid_hex) if bssid_hex else None
+    started = time.ticks_ms()
+    try:
+        sta_if.connect(ssid, profile["password"], bssid=bssid)
+    except (TypeError, OSError):
+        sta_if.connect(ssid, profile["password"])
+
+    reason = await wait_for_association(sta_if, timeout_ms)
+    if reason is None:
+        print(f"已连接到已保存的网络 '{ssid}'，用时 {time.ticks_diff(time.ticks_ms(), started)} 毫秒。网络配置: {sta_if.ifconfig()}")
+        g_profiles.remember(ssid, profile["password"], sta_if)
+        return sta_if.ifconfig()[0]
+
+    print(f"连接已保存的网络 '{ssid}' 失败 ({reason})")
+    sta_if.disconnect()
+    if static_ip:
+        try:
+            sta_if.ifconfig('dhcp')
+        except Exception:
+            pass
+    return None
+
+async def connect_known_networks():
+    recent = g_profiles.most_recent()
+    if recent is None:
+        return None
+
+    print(f"发现 {len(g_profiles.profiles)} 个已保存的网络，先尝试快速重连最近使用的 '{recent['ssid']}'...")
+    ip = await connect_profile(recent, FAST_RECONNECT_TIMEOUT_MS, recent.get("bssid", ""), recent.get("channel", 0))
+    if ip:
+        return ip
+
+    candidates = [candidate for candidate in g_profiles.ranked(await scan_wifi_networks()) if candidate[0] is not recent]
+    for profile, entry in candidates:
+        print(f"尝试已保存的网络 '{profile['ssid']}' (优先级 {profile['priority']}，信号 {entry['rssi']} dBm)...")
+        ip = await connect_profile(profile, WIFI_CONNECT_TIMEOUT * 1000, entry["bssid"], entry["channel"])
+        if ip:
+            return ip
+    print("没有可用的已保存网络。")
+    return None
+
+async def roam_watchdog():
+    global g_sta_ip
+    failed_rounds = 0
+    delay = ROAM_CHECK_INTERVAL
+    while True:
+        await asyncio.sleep(delay)
+        delay = ROAM_CHECK_INTERVAL
+        if g_radio_lock.locked() or g_radio.sta.isconnected():
+            failed_rounds = 0
+            continue
+        if not g_sta_ip and not failed_rounds:
+            continue
+        if g_sta_ip:
+            print("与路由器的连接已断开，按优先级和信号强度重新选择已保存的网络...")
+            g_sta_ip = ""
+        async with g_radio_lock:
+            ip = await connect_known_networks()
+            if not ip:
+                failed_rounds += 1
+                if failed_rounds >= ROAM_AP_FALLBACK_ROUNDS and not g_portal_host:
+                    print("已保存的网络均不可用，开启 SoftAP 以便重新配网。")
+                    await start_portal_ap()
+        if ip:
+            g_sta_ip = ip
+            failed_rounds = 0
+        else:
+            delay = min(ROAM_CHECK_INTERVAL << min(failed_rounds, 8), ROAM_MAX_RETRY_INTERVAL)
+            print(f"第 {failed_rounds} 轮重连失败，{delay} 秒后重试。")
+
+def start_connection_job(ssid, password):
+    global g_next_job_id
+    job = {"id": g_next_job_id, "ssid": ssid, "state": JOB_QUEUED, "ip": "", "error": "", "reason": ""}
+    g_next_job_id += 1
+    g_jobs[job["id"]] = job
+    while len(g_jobs) > MAX_JOBS:
+        del g_jobs[min(g_jobs)]
+    asyncio.create_task(run_connection_job(job, password))
+    return job
+
+async def run_connection_job(job, password):
+    try:
+        is_connected, ip, reason = await attempt_wifi_connection(job["ssid"], password, job)
+    except Exception as e:
+        print(f"连接任务 {job['id']} 出错: {e}")
+        is_connected, reason = False, "timeout"
+    if is_connected:
+        global g_sta_ip
+        g_sta_ip = job["ip"]
+        g_profiles.remember(job["ssid"], password, g_radio.sta)
+        set_job_state(job, JOB_DONE)
+    else:
+        job["reason"] = reason
+        job["error"] = CONNECT_FAILURE_MESSAGES.get(reason, CONNECT_FAILURE_MESSAGES["timeout"]).format(job["ssid"])
+        set_job_state(job, JOB_FAILED)
+
+def get_job(query_string):
+    job_id = parse_form_data(query_string).get("job", "")
+    if not job_id:
+        return g_jobs[max(g_jobs)] if g_jobs else None
+    try:
+        return g_jobs.get(int(job_id))
+    except ValueError:
+        return None
+
+def job_to_json(job):
+    return json.dumps({"job": job["id"], "ssid": job["ssid"], "state": job["state"], "ip": job["ip"], "error": job["error"], "reason": job["reason"]})
+
+async def route_index(request, reader, response):
+    get_params = parse_form_data(request.query_string)
+    ssid_from_get = get_params.get("ssid", "").strip()
+    password_from_get = get_params.get("password", "")
+
+    if ssid_from_get:
+        print(f"在 GET 参数中发现 SSID: '{ssid_from_get}'。正在后台连接...")
+        job = start_connection_job(ssid_from_get, password_from_get)
+        html_page = generate_initial_html(pre_selected_ssid=ssid_from_get, job_id=job["id"])
+        await response.send(200, html_page, CONTENT_TYPE_HTML)
+    else:
+        await send_static_page(response, request, g_index_page)
+
+async def route_static_asset(request, reader, response):
+    await send_static_asset(response, request, g_asset_paths[request.path])
+
+async def route_status(request, reader, response):
+    job = get_job(request.query_string)
+    if job is None:
+        await response.send(404, json.dumps({"error": "unknown job"}), CONTENT_TYPE_JSON)
+    else:
+        await response.send(200, job_to_json(job), CONTENT_TYPE_JSON)
+
+async def route_success(request, reader, response):
+    if g_sta_ip:
+        await response.send(200, generate_success_html(g_sta_ip), CONTENT_TYPE_HTML)
+    else:
+        html_page = generate_error_html("设备尚未连接到任何 WiFi 网络。")
+        await response.send(409, html_page, CONTENT_TYPE_HTML)
+
+async def route_time(request, reader, response):
+    time_status = g_timekeeper.status()
+    time_status["beijing"] = format_time(get_beijing_time_tuple())
+    await response.send(200, json.dumps(time_status), CONTENT_TYPE_JSON)
+
+async def route_events(request, reader, response):
+    await send_events(reader, response)
+
+async def route_scan(request, reader, response):
+    await send_scan_results(response, request.query_string)
+
+async def route_metrics(request, reader, response):
+    await response.send(200, g_metrics.render(), CONTENT_TYPE_METRICS, CACHE_NO_CACHE)
+
+async def route_configure(request, reader, response):
+    content_length = request.content_length()
+    if content_length is None:
+        print("缺少 Content-Length 头部")
+        await response.send(411)
+        return
+
+    post_data_bytes = await request.read_body(reader, content_length)
+    if post_data_bytes is None:
+        print("接收 POST 数据时连接关闭")
+        response.keep_alive = False
+        return
+
+    print(f"收到的 POST 数据: {len(post_data_bytes)} 字节")
+
+    form_data = parse_form_data(post_data_bytes)
+    ssid_input = form_data.get("ssid", "").strip()
+    password_input = form_data.get("password", "")
+
+    if not ssid_input:
+        error_message = "未选择网络。请从列表中选择一个网络。"
+        html_page = generate_error_html(error_message, pre_selected_ssid=ssid_input)
+        await response.send(400, html_page, CONTENT_TYPE_HTML)
+    else:
+        job = start_connection_job(ssid_input, password_input)
+        await response.send(202, job_to_json(job), CONTENT_TYPE_JSON)
+
+def parse_priority(value):
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HttpError(400, "priority 必须是整数")
+
+async def route_profiles(request, reader, response):
+    await response.send(200, g_profiles.to_json(), CONTENT_TYPE_JSON, CACHE_NO_STORE)
+
+async def route_add_profile(request, reader, response):
+    content_length = request.content_length()
+    if content_length is None:
+        await response.send(411)
+        return
+    body = await request.read_body(reader, content_length)
+    if body is None:
+        response.keep_alive = False
+        return
+    form_data = parse_form_data(body)
+    ssid = form_data.get("ssid", "").strip()
+    if not ssid:
+        await response.send(400, json.dumps({"error": "missing ssid"}), CONTENT_TYPE_JSON)
+        return
+    g_profiles.add(ssid, form_data.get("password"), parse_priority(form_data.get("priority", "")))
+    g_profiles.save()
+    await response.send(200, g_profiles.to_json(), CONTENT_TYPE_JSON, CACHE_NO_STORE)
+
+async def route_remove_profile(request, reader, response):
+    ssid = parse_form_data(request.query_string).get("ssid", "")
+    if not g_profiles.remove(ssid):
+        await response.send(404, json.dumps({"error": "unknown profile"}), CONTENT_TYPE_JSON)
+        return
+    await response.send(200, g_profiles.to_json(), CONTENT_TYPE_JSON, CACHE_NO_STORE)
+
+ROUTES = {
+    ("GET", "/"): route_index,
+    ("GET", "/status"): route_status,
+    ("GET", "/success"): route_success,
+    ("GET", "/time"): route_time,
+    ("GET", "/events"): route_events,
+    ("GET", "/scan"): route_scan,
+    ("POST", "/configure"): route_configure,
+    ("GET", "/profiles"): route_profiles,
+    ("POST", "/profiles"): route_add_profile,
+    ("DELETE", "/profiles"): route_remove_profile,
+}
+if METRICS_ENABLED:
+    ROUTES[("GET", "/metrics")] = route_metrics
+
+def wants_captive_redirect(request):
+    if not g_portal_host or request.method != "GET":
+        return False
+    host = request.header("host", g_portal_host).split(":")[0]
+    if g_sta_ip and host == g_sta_ip:
+        return False
+    return request.path in CAPTIVE_PROBE_PATHS or host != g_portal_host.split(":")[0]
+
+async def captive_portal_redirect(request, response):
+    if not wants_captive_redirect(request):
+        return False
+    await response.send(302, b"", None, f"Location: http://{g_portal_host}/\r\n".encode() + CACHE_NO_STORE)
+    return True
+
+def log_request(request, response, elapsed_ms):
+    print(f"请求: {request.method} {request.path} -> {response.status} ({elapsed_ms} 毫秒)")
+
+def record_request_metrics(request, response, elapsed_ms):
+    route = request.path if (request.method, request.path) in ROUTES else "other"
+    g_metrics.observe_request(request.method, route, response.status, elapsed_ms)
+    g_metrics.sample_memory()
+
+g_before_request.append(captive_portal_redirect)
+g_after_request.append(log_request)
+if METRICS_ENABLED:
+    g_after_request.append(record_request_metrics)
+
+def reserve_request_heap():
+    if gc.mem_free() >= REQUEST_HEAP_BUDGET:
+        return
+    gc.collect()
+    if gc.mem_free() < REQUEST_HEAP_BUDGET:
+        raise HttpError(503, f"可用堆内存不足 {REQUEST_HEAP_BUDGET} 字节，拒绝请求")
+
+async def handle_request(request, reader, response):
+    started = time.ticks_ms()
+    try:
+        for hook in g_before_request:
+            if await hook(request, response):
+                return
+        handler = ROUTES.get((request.method, request.path))
+        if handler is None:
+            await response.send(404)
+        else:
+            await handler(request, reader, response)
+    except asyncio.TimeoutError:
+        raise
+    except Exception as e:
+        status = e.status if isinstance(e, HttpError) else 503 if isinstance(e, MemoryError) else 500
+        print(f"请求无效: {e}" if isinstance(e, HttpError) else f"处理请求时出错: {e!r}")
+        response.keep_alive = False
+        if not response.headers_sent:
+            await response.send(status)
+    finally:
+        elapsed_ms = time.ticks_diff(time.ticks_ms(), started)
+        for hook in g_after_request:
+            hook(request, response, elapsed_ms)
+
+async def handle_client(reader, writer):
+    if not g_free_slots:
+        print(f"所有 {MAX_CONNECTION_SLOTS} 个连接槽位都在使用中，返回 503")
+        if METRICS_ENABLED:
+            g_metrics.observe_rejected(503)
+        try:
+            writer.write(SLOTS_EXHAUSTED_RESPONSE)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except:
+            pass
+        return
+
+    slot = g_free_slots.pop()
+    request = slot.request
+    response = slot.response
+    request.reset()
+    response.reset(writer)
+    transport = getattr(writer, "transport", None)
+    if transport is not None:
+        transport.set_write_buffer_limits(0)
+    served = 0
+    try:
+        while True:
+            response.reset(writer)
+            idle = served and not request.filled
+            try:
+                has_request = await asyncio.wait_for(request.read_head(reader), KEEPALIVE_IDLE_TIMEOUT if idle else HEADER_TIMEOUT)
+            except asyncio.TimeoutError:
+                if not request.filled:
+                    print(f"连接空闲超过 {KEEPALIVE_IDLE_TIMEOUT if idle else HEADER_TIMEOUT} 秒，关闭连接")
+                    return
+                raise HttpError(408, "请求头未在 {} 秒内收完".format(HEADER_TIMEOUT))
+            if not has_request:
+                return
+
+            request.content_length()
+            served += 1
+            response.http11 = request.version == "HTTP/1.1"
+            response.keep_alive = request.wants_keep_alive() and served < MAX_KEEPALIVE_REQUESTS
+            if HAS_MEM_INFO:
+                reserve_request_heap()
+                heap_before = gc.mem_alloc()
+            await handle_request(request, reader, response)
+            if HAS_MEM_INFO and gc.mem_alloc() - heap_before > REQUEST_HEAP_BUDGET:
+                print(f"请求 {request.path} 超出 {REQUEST_HEAP_BUDGET} 字节的堆预算，立即回收")
+                gc.collect()
+            if not response.keep_alive or not await request.discard_body(reader):
+                return
+            request.next_request()
+
+    except asyncio.TimeoutError:
+        print(f"客户端在 {SEND_TIMEOUT} 秒内未接收响应数据，关闭连接")
+    except Exception as e:
+        status = e.status if isinstance(e, HttpError) else 500
+        print(f"请求无效: {e}" if isinstance(e, HttpError) else f"处理客户端时出错: {e}")
+        if not response.headers_sent:
+            if METRICS_ENABLED:
+                g_metrics.observe_rejected(status)
+            try:
+                response.keep_alive = False
+                await response.send(status)
+            except:
+                pass
+    finally:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except:
+            pass
+        g_free_slots.append(slot)
+
+def build_dns_answer(ip):
+    return b"\xc0\x0c\x00\x01\x00\x01" + struct.pack("!IH", DNS_TTL, 4) + bytes(int(part) for part in ip.split("."))
+
+def build_dns_response(query, length, answer, reply):
+    if length < 12 or query[2] & 0xf8 or struct.unpack_from("!H", query, 4)[0] != 1:
+        return 0
+    i = 12
+    while i < length and query[i]:
+        if query[i] & 0xc0:
+            return 0
+        i += query[i] + 1
+    end = i + 5
+    if end > length:
+        return 0
+    qtype = struct.unpack_from("!H", query, i + 1)[0]
+    reply[0:end] = query[0:end]
+    reply[2] = 0x80 | (query[2] & 0x01)
+    reply[3] = 0x80
+    if qtype == 1 or qtype == 255:
+        reply[6:12] = b"\x00\x01\x00\x00\x00\x00"
+        reply[end:end + len(answer)] = answer
+        return end + len(answer)
+    reply[6:12] = b"\x00\x00\x00\x00\x00\x00"
+    return end
+
+async def run_dns_server(ap_ip):
+    answer = build_dns_answer(ap_ip)
+    reply = bytearray(DNS_MAX_PACKET + len(answer))
+    reply_mv = memoryview(reply)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        sock.bind(socket.getaddrinfo(BIND_ADDRESS, DNS_PORT)[0][-1])
+    except OSError as e:
+        print(f"DNS 服务器绑定端口 {DNS_PORT} 失败: {e}")
+        sock.close()
+        return
+    print(f"强制门户 DNS 已在 udp://{ap_ip}:{DNS_PORT} 启动，所有 A 记录解析到 {ap_ip}")
+    try:
+        while True:
+            await wait_readable(sock)
+            try:
+                data, addr = sock.recvfrom(DNS_MAX_PACKET)
+            except OSError:
+                continue
+            size = build_dns_response(data, len(data), answer, reply)
+            if size:
+                try:
+                    sock.sendto(reply_mv[:size], addr)
+                except OSError as e:
+                    print(f"DNS 应答发送失败: {e}")
+    finally:
+        sock.close()
+
+async def serve(ap_ip):
+    prepare_static_pages()
+    g_startup.mark("page_prerender")
+    server = await asyncio.start_server(handle_client, BIND_ADDRESS, WEB_PORT, backlog=LISTEN_BACKLOG)
+    g_startup.mark("socket_bound")
+    print(f"Web 服务器已在 http://{ap_ip}:{WEB_PORT} 启动")
+    trigger_scan_refresh()
+    asyncio.create_task(g_timekeeper.run())
+    asyncio.create_task(roam_watchdog())
+    try:
+        await server.wait_closed()
+    finally:
+        server.close()
+
+def main():
+    print("--- ESP32-S3 WiFi 设置门户 ---")
+    g_startup.mark("import")
+    try:
+        asyncio.run(boot())
+    except KeyboardInterrupt:
+        print("\n服务器被用户停止。")
+    except OSError as e:
+        print(f"绑定服务器套接字失败: {e}")
+    except Exception as e:
+        print(f"\n主循环中发生未预期的错误: {e}")
+    finally:
+        asyncio.new_event_loop()
+        print("Web 服务器套接字已关闭。")
+
+async def start_portal_ap():
+    global g_portal_host
+    ap, ap_ip = await g_radio.start_ap(AP_SSID, AP_PASSWORD)
+    if not ap:
+        return None
+    g_portal_host = ap_ip if WEB_PORT == 80 else f"{ap_ip}:{WEB_PORT}"
+    asyncio.create_task(run_dns_server(ap_ip))
+    print(f"请连接到 WiFi '{AP_SSID}' (密码 '{AP_PASSWORD}')，然后在浏览器中打开 http://{ap_ip}:{WEB_PORT} 。")
+    return ap_ip
+
+async def boot():
+    global g_sta_ip
+    print("正在进行初始 WiFi 接口清理...")
+    if not await g_radio.reset():
+        print(f"接口在 {INTERFACE_RESET_TIMEOUT_MS} 毫秒内未完成清理，继续启动。")
+    g_startup.mark("interface_reset")
+
+    sta_ip = await connect_known_networks()
+    if sta_ip:
+        g_startup.mark("known_networks")
+        g_sta_ip = sta_ip
+        await set_time()
+        g_startup.mark("ntp_sync")
+        print(f"设备已联网，可在 http://{sta_ip}:{WEB_PORT} 查看状态或重新配网。")
+        await serve(sta_ip)
+        return
+
+    ap_ip = await start_portal_ap()
+    g_startup.mark("ap_active")
+    if not ap_ip:
+        print("致命错误：无法启动初始 SoftAP。程序退出。")
+        return
+    await serve(ap_ip)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import datetime
+import gc
+import sys
+import time
+import tracemalloc
+import types
+import urllib.parse
+
+import ESP32S3_WIFI_Setup_Time as portal
+
+# 门户内部算法的主机端校验与基准测试, 不需要启动服务器。
+# 用法: python3 host_bench.py [time] [form] [heap]
+# 任何校验失败时以非零状态退出。
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def timed(label, func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40}{iterations:>8} 次  {elapsed * 1000000 / iterations:>8.2f} 微秒/次")
+    return elapsed
+
+
+def legacy_days_from_civil(year, month, day):
+    # 改写前的实现: 逐年、逐月累加天数
+    days_in_month = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+    days = 0
+    for y in range(1970, year):
+        days += 366 if (y % 4 == 0 and y % 100 != 0) or y % 400 == 0 else 365
+    for m in range(1, month):
+        days += days_in_month[m - 1]
+        if m == 2 and ((year % 4 == 0 and year % 100 != 0) or year % 400 == 0):
+            days += 1
+    return days + day - 1
+
+
+def check_time(args):
+    failures = 0
+    day = EPOCH
+    last = datetime.date(2099, 12, 31)
+    checked = 0
+    while day <= last:
+        days = (day - EPOCH).days
+        if portal.days_from_civil(day.year, day.month, day.day) != days:
+            print(f"days_from_civil({day}) 错误")
+            failures += 1
+        if portal.civil_from_days(days) != (day.year, day.month, day.day):
+            print(f"civil_from_days({days}) 错误: {portal.civil_from_days(days)}")
+            failures += 1
+        if portal.weekday_from_days(days) != day.weekday():
+            print(f"weekday_from_days({days}) 错误")
+            failures += 1
+        timestamp = days * 86400 + (days * 7919) % 86400
+        expected = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=timestamp + portal.UTC_OFFSET_SECONDS)
+        expected_tuple = (expected.year, expected.month, expected.day, expected.hour, expected.minute, expected.second, expected.weekday())
+        if portal.time_tuple_from_timestamp(timestamp, portal.UTC_OFFSET_SECONDS) != expected_tuple:
+            print(f"time_tuple_from_timestamp({timestamp}) 错误")
+            failures += 1
+        checked += 1
+        day += datetime.timedelta(days=1)
+    print(f"已对照 datetime 校验 1970-01-01 至 2099-12-31 共 {checked} 天, 失败 {failures} 处")
+
+    samples = [(2099, 12, 31), (2026, 10, 17), (1970, 1, 1)]
+    for year, month, day in samples:
+        timed(f"days_from_civil{(year, month, day)}", lambda: portal.days_from_civil(year, month, day), args.iterations)
+        timed(f"legacy_days_from_civil{(year, month, day)}", lambda: legacy_days_from_civil(year, month, day), args.iterations)
+    timed("time_tuple_from_timestamp", lambda: portal.time_tuple_from_timestamp(4102444799, portal.UTC_OFFSET_SECONDS), args.iterations)
+    return failures
+
+
+def legacy_unquote(s):
+    # 改写前的实现: 逐字符拼接 str, 且把每个 %XX 当作一个独立字符
+    res = ''
+    i = 0
+    while i < len(s):
+        if s[i] == '%':
+            try:
+                res += chr(int(s[i + 1:i + 3], 16))
+                i += 3
+            except (ValueError, IndexError):
+                res += s[i]
+                i += 1
+        elif s[i] == '+':
+            res += ' '
+            i += 1
+        else:
+            res += s[i]
+            i += 1
+    return res
+
+
+def check_form(args):
+    failures = 0
+    cases = [
+        "ssid=Office&password=office123",
+        "ssid=%E5%AE%9E%E9%AA%8C%E5%AE%A4&password=lab-2024",
+        "ssid=a+b&password=p%2Bq%26r%3Ds",
+        "ssid=&password=",
+        "ssid=x&ssid=y&since=12",
+        "password=%zz%4&ssid=%",
+        "ssid=" + urllib.parse.quote("咖啡店 5G") + "&password=" + urllib.parse.quote("密码!@#$%^&*()" * 8, safe=""),
+    ]
+    for case in cases:
+        expected = dict(urllib.parse.parse_qsl(case, keep_blank_values=True))
+        result = portal.parse_form_data(case.encode())
+        if result != expected:
+            print(f"parse_form_data({case!r}) 错误: {result} != {expected}")
+            failures += 1
+    if portal.parse_form_data(b"ssid=x&bare") != {"ssid": "x"}:
+        print("没有 '=' 的字段应被忽略")
+        failures += 1
+    try:
+        portal.parse_form_data(b"ssid=%FF%FE")
+        print("无效 UTF-8 未被拒绝")
+        failures += 1
+    except portal.HttpError as e:
+        if e.status != 400:
+            failures += 1
+    print(f"已对照 urllib.parse 校验 {len(cases) + 2} 个用例, 失败 {failures} 处")
+
+    # 长密码 (全部百分号转义的中文) 与长查询串, 每档长度增加 10 倍, 耗时应大致线性增长
+    per_char = {}
+    for size in (100, 1000, 10000):
+        password = urllib.parse.quote("密" * size, safe="")
+        body = f"ssid=Office&password={password}".encode()
+        iterations = max(1, args.iterations // size)
+        elapsed = timed(f"parse_form_data 密码 {len(body)} 字节", lambda: portal.parse_form_data(body), iterations)
+        per_char[size] = elapsed / iterations / size
+        legacy_body = body.decode()
+        timed(f"legacy_unquote 密码 {len(body)} 字节", lambda: legacy_unquote(legacy_body), iterations)
+    print(f"每字符耗时 10000 档 / 100 档: {per_char[10000] / per_char[100]:.2f} (线性时约为 1)")
+    for pairs in (10, 100, 1000):
+        query = "&".join(f"k{i}=v%20{i}" for i in range(pairs))
+        iterations = max(1, args.iterations // pairs)
+        timed(f"parse_form_data 查询串 {pairs} 对", lambda: portal.parse_form_data(query), iterations)
+    return failures
+
+
+HEAP_ROUTES = ("/", "/time", "/profiles", "/status?job=1", "/missing")
+HEAP_WARMUP_REQUESTS = 500
+HEAP_GROWTH_LIMIT = 1024
+
+
+async def fetch(reader, writer, path, headers=""):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept-Encoding: gzip\r\n{headers}\r\n".encode())
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    await reader.readexactly(length)
+    return int(head.split(b" ", 2)[1]), b"connection: close" in head.lower()
+
+
+async def run_requests(port, paths, count):
+    reader = writer = None
+    statuses = {}
+    for i in range(count):
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        status, closed = await fetch(reader, writer, paths[i % len(paths)])
+        statuses[status] = statuses.get(status, 0) + 1
+        if closed:
+            writer.close()
+            await writer.wait_closed()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+        await writer.wait_closed()
+    return statuses
+
+
+async def measure_heap(args):
+    portal.g_after_request.remove(portal.log_request)
+    portal.prepare_static_pages()
+    paths = HEAP_ROUTES + tuple(asset.url for asset in portal.g_assets.values())
+    server = await asyncio.start_server(portal.handle_client, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    failures = 0
+    try:
+        await run_requests(port, paths, HEAP_WARMUP_REQUESTS)
+        tracemalloc.start()
+        # 两个等长的稳态窗口之后各测一次, 一次性的分配 (连接对象、计数器) 两次都在, 差值只反映持续增长
+        samples = []
+        for _ in range(2):
+            statuses = await run_requests(port, paths, args.requests)
+            await asyncio.sleep(0.1)
+            gc.collect()
+            samples.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        growth = samples[1] - samples[0]
+        print(f"每个窗口 {args.requests} 个请求 (keep-alive, 每 {portal.MAX_KEEPALIVE_REQUESTS} 个换一次连接): {statuses}")
+        print(f"第二个窗口的堆增长 {growth} 字节 (上限 {HEAP_GROWTH_LIMIT}), 首个窗口后常驻 {samples[0]} 字节")
+        if growth > HEAP_GROWTH_LIMIT:
+            print("稳态请求使堆持续增长")
+            failures += 1
+
+        # 模拟设备堆内存耗尽: 预算不足时请求应在分派前被 503 拒绝
+        real_gc, real_has_mem_info = portal.gc, portal.HAS_MEM_INFO
+        portal.gc = types.SimpleNamespace(mem_free=lambda: portal.REQUEST_HEAP_BUDGET - 1, mem_alloc=lambda: 0, collect=lambda: None)
+        portal.HAS_MEM_INFO = True
+        try:
+            statuses = await run_requests(port, ("/time",), 1)
+        finally:
+            portal.gc, portal.HAS_MEM_INFO = real_gc, real_has_mem_info
+        print(f"可用堆低于 {portal.REQUEST_HEAP_BUDGET} 字节时: {statuses}")
+        if statuses != {503: 1}:
+            failures += 1
+    finally:
+        server.close()
+        await server.wait_closed()
+        portal.g_after_request.insert(0, portal.log_request)
+    return failures
+
+
+def check_heap(args):
+    return asyncio.run(measure_heap(args))
+
+
+SUITES = {
+    "time": check_time,
+    "form": check_form,
+    "heap": check_heap,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="配网门户算法校验与基准测试")
+    parser.add_argument("suites", nargs="*", help=f"要运行的测试项 ({', '.join(SUITES)}), 默认全部")
+    parser.add_argument("--iterations", type=int, default=20000, help="每项基准的调用次数")
+    parser.add_argument("--requests", type=int, default=3000, help="heap 测试中每个测量窗口的请求数")
+    args = parser.parse_args()
+    for name in args.suites:
+        if name not in SUITES:
+            parser.error(f"未知的测试项: {name}")
+    failures = 0
+    for name in args.suites or list(SUITES):
+        print(f"== {name} ==")
+        failures += SUITES[name](args)
+    sys.exit(1 if failures else 0)
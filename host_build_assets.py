@@ -0,0 +1,48 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+
+# 构建固件镜像时运行: 把 static/ 下的 CSS/JS 按内容哈希命名并预先 gzip 压缩, 输出到 www/ 供烧录到设备 flash。
+# 用法: python3 host_build_assets.py [--source static] [--output www]
+# 然后: mpremote cp -r www :
+
+ASSET_SOURCES = ("portal.css", "portal.js", "success.js")
+MANIFEST = "manifest.json"
+
+
+def build(source_dir="static", output_dir="www"):
+    os.makedirs(output_dir, exist_ok=True)
+    for name in os.listdir(output_dir):
+        os.remove(os.path.join(output_dir, name))
+    manifest = {}
+    for name in ASSET_SOURCES:
+        with open(os.path.join(source_dir, name), "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        stem, ext = name.rsplit(".", 1)
+        hashed_name = f"{stem}.{digest}.{ext}"
+        # mtime=0 保证相同内容生成完全相同的镜像
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        with open(os.path.join(output_dir, hashed_name), "wb") as f:
+            f.write(data)
+        entry = {"hash": digest, "file": hashed_name, "size": len(data)}
+        if len(compressed) < len(data):
+            with open(os.path.join(output_dir, hashed_name + ".gz"), "wb") as f:
+                f.write(compressed)
+            entry["gzip_file"] = hashed_name + ".gz"
+            entry["gzip_size"] = len(compressed)
+        manifest[name] = entry
+        print(f"{name} -> {hashed_name}: {len(data)} 字节, gzip {entry.get('gzip_size', '-')} 字节")
+    with open(os.path.join(output_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成带内容哈希并预压缩的静态资源")
+    parser.add_argument("--source", default="static", help="CSS/JS 源文件目录")
+    parser.add_argument("--output", default="www", help="输出目录, 整个目录上传到设备")
+    args = parser.parse_args()
+    build(args.source, args.output)
@@ -0,0 +1,280 @@
+import calendar
+import socket
+import struct
+import sys
+import threading
+import time
+import types
+
+# 在 CPython 上模拟 MicroPython 的 network / machine 模块, 让配网门户可以在 Linux 主机上运行和压测。
+# 用法: python3 host_emulation.py [--port 8080] [--ntp-port 12300]
+
+SCAN_NETWORKS = [
+    {"ssid": "Office", "bssid": b"\x24\x0a\xc4\x00\x00\x01", "channel": 6, "rssi": -48, "authmode": 3, "hidden": False, "password": "office123"},
+    {"ssid": "Office", "bssid": b"\x24\x0a\xc4\x00\x00\x02", "channel": 11, "rssi": -71, "authmode": 3, "hidden": False, "password": "office123"},
+    {"ssid": "实验室", "bssid": b"\x24\x0a\xc4\x00\x00\x03", "channel": 1, "rssi": -63, "authmode": 4, "hidden": False, "password": "lab-2024"},
+    {"ssid": "Guest", "bssid": b"\x24\x0a\xc4\x00\x00\x04", "channel": 1, "rssi": -80, "authmode": 0, "hidden": False, "password": ""},
+]
+SCAN_DURATION = 2.0
+ASSOCIATION_DELAY = 1.5
+WRONG_PASSWORD_DELAY = 1.0
+NO_AP_FOUND_DELAY = 2.5
+# None 表示正常行为; 也可以设为 "timeout" (永远无法完成握手) 或 "drop" (连上后立即断开)
+FAILURE_MODE = None
+# RTC 相对主机时钟的漂移 (ppm), 用于验证门户的漂移估计
+RTC_DRIFT_PPM = 0.0
+
+AP_IP = "127.0.0.1"
+STA_IP = "192.168.31.88"
+NTP_PORT = 12300
+DNS_PORT = 10053
+
+
+def _install_time_shims():
+    if hasattr(time, "ticks_ms"):
+        return
+    period = 1 << 30
+
+    def ticks_diff(a, b):
+        return ((a - b + (period >> 1)) & (period - 1)) - (period >> 1)
+
+    time.ticks_ms = lambda: int(time.monotonic() * 1000) & (period - 1)
+    time.ticks_us = lambda: int(time.monotonic() * 1000000) & (period - 1)
+    time.ticks_add = lambda a, b: (a + b) & (period - 1)
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+
+class WLAN:
+    _instances = {}
+
+    def __new__(cls, interface_id=0):
+        if interface_id not in cls._instances:
+            instance = super().__new__(cls)
+            instance._init(interface_id)
+            cls._instances[interface_id] = instance
+        return cls._instances[interface_id]
+
+    def _init(self, interface_id):
+        self.interface_id = interface_id
+        self._active = False
+        self._config = {
+            "essid": "",
+            "password": "",
+            "authmode": AUTH_OPEN,
+            "channel": 1,
+            "hidden": False,
+            "mac": bytes([0x24, 0x0a, 0xc4, 0x12, 0x34, 0x50 + interface_id]),
+            "reconnects": -1,
+            "txpower": 20,
+        }
+        self._status = STAT_IDLE
+        self._target = None
+        self._connect_started = 0.0
+        self._ifconfig = (AP_IP, "255.255.255.0", AP_IP, "8.8.8.8") if interface_id == AP_IF else ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self._status = STAT_IDLE
+            self._target = None
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._ifconfig
+        if config == "dhcp":
+            self._ifconfig = ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+            return
+        self._ifconfig = tuple(config)
+
+    def scan(self):
+        if self.interface_id != STA_IF or not self._active:
+            raise OSError("STA 接口未激活")
+        time.sleep(SCAN_DURATION)
+        return [(net["ssid"].encode("utf-8") if not net["hidden"] else b"", net["bssid"], net["channel"], net["rssi"], net["authmode"], net["hidden"]) for net in SCAN_NETWORKS]
+
+    def connect(self, ssid=None, key=None, *, bssid=None):
+        if not self._active:
+            raise OSError("STA 接口未激活")
+        self._target = (ssid, key or "", bssid)
+        self._connect_started = time.monotonic()
+        self._status = STAT_CONNECTING
+
+    def disconnect(self):
+        self._status = STAT_IDLE
+        self._target = None
+        if self.interface_id == STA_IF:
+            self._ifconfig = ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+    def _candidates(self):
+        ssid, key, bssid = self._target
+        return [net for net in SCAN_NETWORKS if net["ssid"] == ssid and (bssid is None or net["bssid"] == bssid)]
+
+    def _advance(self):
+        if self._status != STAT_CONNECTING or self._target is None:
+            return
+        elapsed = time.monotonic() - self._connect_started
+        candidates = self._candidates()
+        if not candidates:
+            if elapsed >= NO_AP_FOUND_DELAY:
+                self._status = STAT_NO_AP_FOUND
+            return
+        if FAILURE_MODE == "timeout":
+            return
+        if candidates[0]["password"] != self._target[1]:
+            if elapsed >= WRONG_PASSWORD_DELAY:
+                self._status = STAT_WRONG_PASSWORD
+            return
+        if elapsed >= ASSOCIATION_DELAY:
+            if FAILURE_MODE == "drop":
+                self._status = STAT_BEACON_TIMEOUT
+                return
+            self._status = STAT_GOT_IP
+            self._config["channel"] = candidates[0]["channel"]
+            self._config["essid"] = self._target[0]
+            self._ifconfig = (STA_IP, "255.255.255.0", "192.168.31.1", "192.168.31.1")
+
+    def status(self, param=None):
+        self._advance()
+        if param == "rssi":
+            candidates = self._candidates() if self._target else []
+            return candidates[0]["rssi"] if candidates else 0
+        return self._status
+
+    def isconnected(self):
+        if self.interface_id == AP_IF:
+            return self._active
+        return self.status() == STAT_GOT_IP
+
+
+class RTC:
+    # 与设备一致: 上电时为 2000-01-01, 元组中的年份按门户脚本的约定存为 "年份 - 2000"
+    _anchor = None
+
+    def __init__(self, rtc_id=0):
+        if RTC._anchor is None:
+            RTC._anchor = (int(time.time() * 1000000), 946684800 * 1000000)
+
+    def _now_us(self):
+        host_anchor_us, rtc_anchor_us = RTC._anchor
+        elapsed_us = int(time.time() * 1000000) - host_anchor_us
+        return rtc_anchor_us + elapsed_us + int(elapsed_us * RTC_DRIFT_PPM / 1000000)
+
+    def datetime(self, datetimetuple=None):
+        if datetimetuple is None:
+            seconds, micros = divmod(self._now_us(), 1000000)
+            tm = time.gmtime(seconds)
+            return (tm[0] - 2000, tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], micros)
+        year, month, day, weekday, hour, minute, second, micros = datetimetuple
+        target_us = calendar.timegm((year + 2000, month, day, hour, minute, second, 0, 0, 0)) * 1000000 + micros
+        RTC._anchor = (int(time.time() * 1000000), target_us)
+
+
+def _reset():
+    print("[emulation] machine.reset() 被调用, 在主机模拟环境中忽略。")
+
+
+STA_IF = 0
+AP_IF = 1
+AUTH_OPEN = 0
+AUTH_WEP = 1
+AUTH_WPA_PSK = 2
+AUTH_WPA2_PSK = 3
+AUTH_WPA_WPA2_PSK = 4
+AUTH_WPA2_ENTERPRISE = 5
+AUTH_WPA3_PSK = 6
+AUTH_WPA2_WPA3_PSK = 7
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_BEACON_TIMEOUT = 200
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+STAT_ASSOC_FAIL = 203
+STAT_HANDSHAKE_TIMEOUT = 204
+
+network = types.ModuleType("network")
+for _name, _value in list(globals().items()):
+    if _name.startswith(("STA_IF", "AP_IF", "AUTH_", "STAT_")):
+        setattr(network, _name, _value)
+network.WLAN = WLAN
+
+machine = types.ModuleType("machine")
+machine.RTC = RTC
+machine.reset = _reset
+
+
+def _ntp_responder(sock):
+    while True:
+        try:
+            data, addr = sock.recvfrom(48)
+        except OSError:
+            return
+        receive_time = time.time()
+        if len(data) < 48:
+            continue
+        transmit_time = time.time()
+        reply = bytearray(48)
+        reply[0] = 0x24
+        reply[1] = 2
+        reply[2] = data[2]
+        reply[3] = 0xec
+        reply[12:16] = b"EMUL"
+        reply[24:32] = data[40:48]
+        for offset, value in ((16, receive_time), (32, receive_time), (40, transmit_time)):
+            seconds = int(value)
+            struct.pack_into("!II", reply, offset, seconds + 2208988800, int((value - seconds) * (1 << 32)))
+        sock.sendto(reply, addr)
+
+
+def start_ntp_responder(port=NTP_PORT, host="127.0.0.1"):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    threading.Thread(target=_ntp_responder, args=(sock,), daemon=True).start()
+    print(f"[emulation] 本地 NTP 应答器已在 udp://{host}:{port} 启动")
+    return sock
+
+
+_install_time_shims()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="在 CPython 上运行 ESP32 配网门户 (模拟硬件)")
+    parser.add_argument("--port", type=int, default=8080, help="HTTP 端口")
+    parser.add_argument("--ntp-port", type=int, default=NTP_PORT, help="本地 NTP 应答器端口")
+    parser.add_argument("--dns-port", type=int, default=DNS_PORT, help="强制门户 DNS 端口 (53 需要 root 权限)")
+    parser.add_argument("--assoc-delay", type=float, default=ASSOCIATION_DELAY, help="模拟关联耗时 (秒)")
+    parser.add_argument("--scan-duration", type=float, default=SCAN_DURATION, help="模拟扫描耗时 (秒)")
+    parser.add_argument("--failure-mode", choices=["timeout", "drop"], default=None, help="模拟连接故障")
+    parser.add_argument("--rtc-drift-ppm", type=float, default=RTC_DRIFT_PPM, help="模拟 RTC 漂移 (ppm)")
+    parser.add_argument("--no-build-assets", action="store_true", help="不生成 www/, 直接从 static/ 提供未压缩的源文件")
+    args = parser.parse_args()
+
+    ASSOCIATION_DELAY = args.assoc_delay
+    SCAN_DURATION = args.scan_duration
+    FAILURE_MODE = args.failure_mode
+    RTC_DRIFT_PPM = args.rtc_drift_ppm
+    sys.modules["host_emulation"] = sys.modules["__main__"]
+    start_ntp_responder(args.ntp_port)
+    if not args.no_build_assets:
+        import host_build_assets
+
+        host_build_assets.build()
+
+    import ESP32S3_WIFI_Setup_Time as portal
+
+    portal.WEB_PORT = args.port
+    portal.NTP_SERVERS = ["127.0.0.1"]
+    portal.NTP_PORT = args.ntp_port
+    portal.DNS_PORT = args.dns_port
+    portal.main()
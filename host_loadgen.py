@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import time
+
+# 配网门户的简易压测工具, 配合 host_emulation.py 在主机上使用。
+# 用法: python3 host_loadgen.py --port 8080 --concurrency 8 --duration 10 / /scan /status
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip().lower()
+    size = len(head)
+    if status == 304 or status == 204:
+        pass
+    elif "content-length" in headers:
+        length = int(headers["content-length"])
+        await reader.readexactly(length)
+        size += length
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            chunk_size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(chunk_size + 2)
+            size += chunk_size
+            if chunk_size == 0:
+                break
+    else:
+        size += len(await reader.read())
+    return status, size, headers.get("connection") != "close"
+
+
+async def client(host, port, routes, deadline, keep_alive, stats, index):
+    reader = writer = None
+    request_number = index
+    while time.monotonic() < deadline:
+        route = routes[request_number % len(routes)]
+        request_number += 1
+        entry = stats.setdefault(route, {"latencies": [], "errors": 0, "bytes": 0, "statuses": {}})
+        started = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            connection = "keep-alive" if keep_alive else "close"
+            writer.write(f"GET {route} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: gzip\r\nConnection: {connection}\r\n\r\n".encode())
+            await writer.drain()
+            status, size, reusable = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            entry["errors"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+            continue
+        entry["latencies"].append(time.monotonic() - started)
+        entry["bytes"] += size
+        entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+        if not (keep_alive and reusable):
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run(args):
+    stats = {}
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(client(args.host, args.port, args.routes, deadline, not args.no_keep_alive, stats, i) for i in range(args.concurrency)))
+    elapsed = time.monotonic() - started
+
+    print(f"{'路由':<24}{'请求数':>8}{'错误':>6}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'KB/s':>10}  状态码")
+    total = 0
+    for route, entry in stats.items():
+        latencies = sorted(entry["latencies"])
+        total += len(latencies)
+        print(f"{route:<24}{len(latencies):>8}{entry['errors']:>6}{len(latencies) / elapsed:>10.1f}"
+              f"{percentile(latencies, 0.5) * 1000:>10.1f}{percentile(latencies, 0.99) * 1000:>10.1f}"
+              f"{entry['bytes'] / 1024 / elapsed:>10.1f}  {entry['statuses']}")
+    print(f"总计 {total} 个请求, 用时 {elapsed:.1f} 秒, 吞吐量 {total / elapsed:.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="配网门户 HTTP 压测工具")
+    parser.add_argument("routes", nargs="*", default=["/", "/scan", "/status"], help="要请求的路径, 轮流发送")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=8, help="并发连接数")
+    parser.add_argument("--duration", type=float, default=10.0, help="压测时长 (秒)")
+    parser.add_argument("--no-keep-alive", action="store_true", help="每个请求都新建连接")
+    asyncio.run(run(parser.parse_args()))
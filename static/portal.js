@@ -0,0 +1,213 @@
+let networks = {};
+let scanVersion = null;
+const config = document.body.dataset;
+const pendingJob = config.pendingJob ? Number(config.pendingJob) : null;
+const preSelectedSsid = config.ssid || '';
+const jobStateText = {
+    queued: '排队等待中...',
+    associating: '正在关联网络...',
+    got_ip: '已获取 IP 地址...',
+    ntp_syncing: '正在同步 NTP 时间...',
+    retrying: '连接失败，正在重试...',
+};
+
+function networkKey(net) {
+    return net.ssid ? net.ssid : '#' + net.bssid;
+}
+
+function signalBars(rssi) {
+    if (rssi >= -55) return '▂▄▆█';
+    if (rssi >= -67) return '▂▄▆';
+    if (rssi >= -78) return '▂▄';
+    return '▂';
+}
+
+function updatePasswordField() {
+    const selectElement = document.getElementById('ssid-select');
+    const option = selectElement.options[selectElement.selectedIndex];
+    const passwordField = document.getElementById('password-field');
+    if (selectElement.value && !(option && option.dataset.open)) {
+        passwordField.style.display = 'block';
+    } else {
+        passwordField.style.display = 'none';
+    }
+}
+
+function updateNetworkList() {
+    const listElement = document.getElementById('network-list');
+    const selectElement = document.getElementById('ssid-select');
+    const selectedSSID = selectElement.value || preSelectedSsid;
+
+    listElement.innerHTML = '';
+    selectElement.innerHTML = '<option value="">-- 请选择 --</option>';
+
+    Object.values(networks)
+        .filter(net => net.ssid)
+        .sort((a, b) => b.rssi - a.rssi)
+        .forEach(net => {
+            const label = `${net.ssid} ${signalBars(net.rssi)} ${net.auth === 0 ? '(开放)' : '🔒'}`;
+
+            const li = document.createElement('li');
+            li.textContent = `${label} ${net.rssi} dBm, 信道 ${net.channel}`;
+            listElement.appendChild(li);
+
+            const option = document.createElement('option');
+            option.value = net.ssid;
+            option.textContent = label;
+            if (net.auth === 0) {
+                option.dataset.open = '1';
+            }
+
+            if (net.ssid === selectedSSID) {
+                option.selected = true;
+            }
+            selectElement.appendChild(option);
+        });
+    updatePasswordField();
+}
+
+// 只有页面加载时的首次请求允许触发扫描, 之后只读取缓存, 新结果由 'scan' 事件通知
+function scanNetworks(cached) {
+    let url = scanVersion === null ? '/scan' : '/scan?since=' + scanVersion;
+    if (cached) {
+        url += (scanVersion === null ? '?' : '&') + 'cached=1';
+    }
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (data.full) {
+                networks = {};
+            }
+            data.removed.forEach(key => delete networks[key]);
+            data.networks.forEach(net => {
+                networks[networkKey(net)] = net;
+            });
+            scanVersion = data.version;
+            updateNetworkList();
+            document.querySelector('h3').textContent = '可用网络:';
+        })
+        .catch(error => {
+            console.error('扫描失败:', error);
+            document.querySelector('h3').textContent = '扫描失败，请刷新页面重试。';
+        });
+}
+
+let currentJob = pendingJob;
+
+function handleJobUpdate(job) {
+    const statusElement = document.getElementById('status');
+    if (job.state === 'done') {
+        window.location.href = '/success';
+    } else if (job.state === 'failed') {
+        statusElement.textContent = job.error;
+        if (job.reason === 'wrong_password') {
+            const passwordInput = document.getElementById('password-input');
+            passwordInput.value = '';
+            passwordInput.focus();
+        }
+    } else {
+        statusElement.textContent = jobStateText[job.state] || job.state;
+        return false;
+    }
+    return true;
+}
+
+let events = null;
+let polling = false;
+
+function eventsOpen() {
+    return events !== null && events.readyState === EventSource.OPEN;
+}
+
+// 事件流未连上 (例如服务器返回 503) 时一直轮询 /status，直到任务结束
+function pollStatus() {
+    polling = true;
+    fetch('/status?job=' + currentJob)
+        .then(response => response.json())
+        .then(job => {
+            if (handleJobUpdate(job) || eventsOpen()) {
+                polling = false;
+            } else {
+                setTimeout(pollStatus, 1000);
+            }
+        })
+        .catch(error => {
+            console.error('状态查询失败:', error);
+            setTimeout(pollStatus, 2000);
+        });
+}
+
+function watchJob(jobId) {
+    currentJob = jobId;
+    if (!polling) {
+        pollStatus();
+    }
+}
+
+function subscribeEvents() {
+    if (!window.EventSource) {
+        return;
+    }
+    events = new EventSource('/events');
+    events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED && currentJob !== null && !polling) {
+            pollStatus();
+        }
+    };
+    events.addEventListener('wifi', (event) => {
+        const job = JSON.parse(event.data);
+        if (job.job === currentJob) {
+            handleJobUpdate(job);
+        }
+    });
+    events.addEventListener('scan', () => scanNetworks(true));
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    scanNetworks();
+    setInterval(() => scanNetworks(true), Number(config.scanInterval));
+    subscribeEvents();
+    if (pendingJob !== null) {
+        document.getElementById('status').textContent = '正在连接到 ' + preSelectedSsid + '...';
+        watchJob(pendingJob);
+    }
+
+    document.getElementById('ssid-select').addEventListener('change', updatePasswordField);
+
+    document.getElementById('wifi-form').addEventListener('submit', (event) => {
+        event.preventDefault();
+
+        const formData = new FormData(event.target);
+        const ssid = formData.get('ssid');
+        const password = formData.get('password');
+
+        if (!ssid) {
+            alert('请选择一个网络。');
+            return;
+        }
+
+        document.getElementById('status').textContent = `正在连接到 ${ssid}...`;
+
+        fetch('/configure', {
+            method: 'POST',
+            body: new URLSearchParams(formData),
+            headers: {
+                'Content-Type': 'application/x-www-form-urlencoded',
+            },
+        })
+        .then(response => {
+            if (response.ok) {
+                return response.json();
+            } else {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+        })
+        .then(job => {
+            watchJob(job.job);
+        })
+        .catch(error => {
+            console.error('连接请求失败:', error);
+            document.getElementById('status').textContent = '连接请求发送失败。';
+        });
+    });
+});
@@ -0,0 +1,11 @@
+// 通过服务器推送 (SSE) 获取设备 RTC 时间，每秒更新一次
+const timeDisplay = document.getElementById('time-display');
+if (window.EventSource) {
+    const events = new EventSource('/events');
+    events.addEventListener('time', (event) => {
+        timeDisplay.textContent = JSON.parse(event.data).beijing;
+    });
+    events.onerror = () => {
+        console.error("时间推送连接中断，正在重连...");
+    };
+}